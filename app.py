@@ -1,6 +1,14 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import os
 import re
+import json
+import math
+import time
+import uuid
+import bisect
+import random
+import threading
+from collections import deque
 import pandas as pd
 import numpy as np
 import sklearn
@@ -16,34 +24,172 @@ from sklearn.preprocessing import StandardScaler
 from transformers import AutoTokenizer, AutoModelForTokenClassification
 from transformers import pipeline
 import torch
+import metrics
+import tracing
+from memory_budget import MemoryBudget, AdaptiveBatcher, admission, current_rss
+from results_store import ResultsStore, file_version, taxonomy_version
 
 # ===== PDF PROCESSING FUNCTIONS =====
-def read_pdf_with_pdfplumber(file_path: str) -> str:
-    """Read PDF using pdfplumber - better for complex layouts"""
-    text = ""
+def read_pdf_pages_with_pdfplumber(file_path: str) -> list:
+    """Read PDF page by page using pdfplumber - one string per page"""
+    pages = []
     try:
         with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+            for page_number, page in enumerate(pdf.pages, 1):
+                with tracing.span('page', cat='pdf', page=page_number):
+                    pages.append(page.extract_text() or "")
     except Exception as e:
         print(f"Error reading {file_path} with pdfplumber: {e}")
+    metrics.inc('pages_extracted', len(pages))
+    return pages
+
+def join_pages(pages: list):
+    """Join page texts into one buffer and return (text, page_starts)"""
+    parts = []
+    page_starts = []
+    offset = 0
+    for page_text in pages:
+        page_starts.append(offset)
+        if page_text:
+            parts.append(page_text + "\n")
+            offset += len(page_text) + 1
+    return "".join(parts), page_starts
+
+def read_pdf_with_pdfplumber(file_path: str) -> str:
+    """Read PDF using pdfplumber - better for complex layouts"""
+    text, _ = join_pages(read_pdf_pages_with_pdfplumber(file_path))
     return text
 
-def pdf_to_text(pdf_path: str) -> str:
-    """Convert PDF to text"""
+def pdf_to_document(pdf_path: str):
+    """Convert PDF to (text, page_starts), page_starts[i] is the offset of page i + 1"""
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"PDF file not found: {pdf_path}")
     
     print(f'get pdf file {pdf_path}')
-    text = read_pdf_with_pdfplumber(pdf_path)
+    with metrics.timer('pdf_to_text'):
+        text, page_starts = join_pages(read_pdf_pages_with_pdfplumber(pdf_path))
     
     if not text.strip():
         raise ValueError("No text extracted from PDF")
     
+    return text, page_starts
+
+def pdf_to_text(pdf_path: str) -> str:
+    """Convert PDF to text"""
+    text, _ = pdf_to_document(pdf_path)
     return text
 
+# ===== SENTENCE SEGMENTATION =====
+# Sentences are (start, end, page) spans over the document buffer, nothing is copied
+# until a sentence is actually sent to a model.
+SENTENCE_END_PATTERN = re.compile(r'[.!?…]+')
+WORD_PATTERN = re.compile(r'\S+')
+
+# Tokens that end with a dot but do not end a sentence (compared lowercase, without the dot)
+ABBREVIATIONS = {
+    # Vietnamese
+    'tp', 'tx', 'tt', 'q', 'p', 'h', 'ths', 'ts', 'pgs', 'gs', 'bs', 'ks', 'cn', 'ng',
+    'nđ', 'qđ', 'tt-btc', 'nđ-cp', 'v.v', 'ctcp', 'tnhh',
+    # English
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'co', 'ltd', 'inc', 'corp', 'jsc', 'no', 'vs',
+    'etc', 'e.g', 'i.e', 'st', 'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep',
+    'oct', 'nov', 'dec',
+}
+SENTENCE_CLOSERS = '"\')]”’»'
+# Dotted abbreviations such as "U.S", "a.m", "Ph.D" (token before the final dot)
+DOTTED_ABBREVIATION_PATTERN = re.compile(r'(?:[^\W\d_]{1,2}\.)+[^\W\d_]{1,2}')
+
+def is_sentence_boundary(text: str, match) -> bool:
+    """Decide if a run of . ! ? ends a sentence (number- and abbreviation-safe)"""
+    end = match.end()
+    # "20.5%", "1.000.000", "TP.HCM", "www.abc.com.vn" - punctuation glued to the next token
+    if end < len(text) and not text[end].isspace() and text[end] not in SENTENCE_CLOSERS:
+        return False
+    if match.group() != '.':
+        return True
+    
+    token_start = match.start()
+    while token_start > 0 and not text[token_start - 1].isspace():
+        token_start -= 1
+    token = text[token_start:match.start()].lstrip('(["\'“‘').lower()
+    
+    if token in ABBREVIATIONS:
+        return False
+    # "U.S. policy" continues, "... in the U.S. Next year" ends: decided by the next word's case
+    if DOTTED_ABBREVIATION_PATTERN.fullmatch(token):
+        following = end
+        while following < len(text) and (text[following].isspace() or text[following] in SENTENCE_CLOSERS):
+            following += 1
+        return following < len(text) and text[following].isupper()
+    # Initials such as "Nguyễn V. A."
+    if len(token) == 1 and token.isalpha():
+        return False
+    # List markers such as "1. Giới thiệu" at the start of a line
+    if token.isdigit() and len(token) <= 2 and (token_start == 0 or text[token_start - 1] == '\n'):
+        return False
+    return True
+
+def make_span(text: str, start: int, end: int, page_starts=None):
+    """Trim whitespace around [start, end) and attach the 1-based page number"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start == end:
+        return None
+    page = bisect.bisect_right(page_starts, start) if page_starts else None
+    return (start, end, page)
+
+def segment_sentences(text: str, page_starts=None) -> list:
+    """
+    Split text into sentence spans without copying the sentences
+    
+    Args:
+        text (str): Document buffer
+        page_starts (list): Offset of each page in text, as returned by pdf_to_document
+    
+    Returns:
+        list: (start, end, page) tuples, text[start:end] is the sentence without its final punctuation,
+              or through the closing quote / bracket when one follows it ('He said "done."')
+    """
+    spans = []
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(text):
+        if not is_sentence_boundary(text, match):
+            continue
+        # Closing quotes / brackets belong to this sentence, not the start of the next one
+        end = match.end()
+        while end < len(text) and text[end] in SENTENCE_CLOSERS:
+            end += 1
+        span = make_span(text, start, end if end > match.end() else match.start(), page_starts)
+        if span:
+            spans.append(span)
+        start = end
+    
+    span = make_span(text, start, len(text), page_starts)
+    if span:
+        spans.append(span)
+    return spans
+
+def count_words(text: str, start: int = 0, end: int = None) -> int:
+    """Same as len(text[start:end].split()) without building the word list"""
+    end = len(text) if end is None else end
+    return sum(1 for _ in WORD_PATTERN.finditer(text, start, end))
+
+# The 'total_sentences' model feature was trained on re.split(r'[.!?]+', text) fragment counts
+LEGACY_SENTENCE_SPLIT_PATTERN = re.compile(r'[.!?]+')
+
+def count_sentence_fragments(text: str) -> int:
+    """Same as len(re.split(r'[.!?]+', text)) without building the fragments"""
+    return sum(1 for _ in LEGACY_SENTENCE_SPLIT_PATTERN.finditer(text)) + 1
+
+def slice_sentence(text: str, start: int, end: int, max_words: int = 50) -> str:
+    """Materialize a sentence span, keeping only its first max_words words"""
+    for count, word in enumerate(WORD_PATTERN.finditer(text, start, end), 1):
+        if count == max_words + 1:
+            return ' '.join(text[start:word.start()].split())
+    return text[start:end]
+
 esg_keywords = {
     'Environmental': {
         'climate_action': [
@@ -323,6 +469,14 @@ for category in esg_keywords.values():
 # Chuyển tất cả từ khóa thành lowercase để so sánh
 all_esg_keywords_lower = [keyword.lower() for keyword in all_esg_keywords]
 
+# (keyword_lower, category, subcategory) in the same order as all_esg_keywords_lower
+esg_keyword_index = [
+    (keyword.lower(), category, subcategory)
+    for category, subcategories in esg_keywords.items()
+    for subcategory, keywords in subcategories.items()
+    for keyword in keywords
+]
+
 # -----------------------------------------------------------------
 # Analyze the Sentiment
 #------------------------------------------------------------------
@@ -428,18 +582,23 @@ def infer_sentiment(vietnamese_sentence):
         raise RuntimeError("Model not loaded. Please run the model loading cell first.")
     
     try:
-        with torch.no_grad():
+        with metrics.timer('sentiment'), torch.no_grad():
+            metrics.inc('transformer_calls', model='sentiment')
+            metrics.observe_batch(1, model='sentiment')
+            
             # Tokenize the sentence
-            encoded = tokenizer(
-                vietnamese_sentence,
-                truncation=True,
-                padding='max_length',
-                max_length=128,
-                return_tensors='pt'
-            ).to(device)
+            with tracing.span('tokenize', cat='model'):
+                encoded = tokenizer(
+                    vietnamese_sentence,
+                    truncation=True,
+                    padding='max_length',
+                    max_length=128,
+                    return_tensors='pt'
+                ).to(device)
             
             # Get prediction
-            score = model(encoded['input_ids'], encoded['attention_mask'])
+            with tracing.span('forward', cat='model', batch_size=1):
+                score = model(encoded['input_ids'], encoded['attention_mask'])
             
             # Return as Python float
             return float(score.item())
@@ -448,6 +607,36 @@ def infer_sentiment(vietnamese_sentence):
         print(f"❌ Error during inference: {e}")
         raise
 
+def infer_sentiment_batch(sentences, max_length=128):
+    """
+    Batched infer_sentiment: one forward pass for the whole list, padded to its longest sentence
+    
+    Returns:
+        list: One float score per sentence
+    """
+    if not sentences:
+        return []
+    if model is None or tokenizer is None:
+        raise RuntimeError("Model not loaded. Please run the model loading cell first.")
+    
+    with metrics.timer('sentiment'), torch.no_grad():
+        metrics.inc('transformer_calls', model='sentiment')
+        metrics.observe_batch(len(sentences), model='sentiment')
+        
+        with tracing.span('tokenize', cat='model', batch_size=len(sentences)):
+            encoded = tokenizer(
+                sentences,
+                truncation=True,
+                padding=True,
+                max_length=max_length,
+                return_tensors='pt'
+            ).to(device)
+        
+        with tracing.span('forward', cat='model', batch_size=len(sentences), seq_len=encoded['input_ids'].shape[1]):
+            scores = model(encoded['input_ids'], encoded['attention_mask'])
+    
+    return [float(score) for score in scores.reshape(-1).tolist()]
+
 print("🚀 Inference function defined!")
 
 # ==============================
@@ -459,7 +648,10 @@ def extract_organization_names(text):
     if len(text) > 512:
         text = text[:512]
 
-    ner_results = ner_pipeline(text)
+    with metrics.timer('ner'):
+        metrics.inc('transformer_calls', model='ner')
+        metrics.observe_batch(1, model='ner')
+        ner_results = ner_pipeline(text)
     organization_names = []
     for entity in ner_results:
 
@@ -467,8 +659,60 @@ def extract_organization_names(text):
             organization_names.append(entity['word'])
     return organization_names
 
-def process_esg_files_working(texts: str, filename: str):
-    all_results = []
+def extract_organization_names_batch(texts):
+    """Batched extract_organization_names, the NER batch size comes from ner_batcher"""
+    if not texts:
+        return []
+    texts = [text[:512] for text in texts]
+    batch_size = ner_batcher.next_batch_size()
+    
+    with metrics.timer('ner'):
+        for chunk_start in range(0, len(texts), batch_size):
+            metrics.inc('transformer_calls', model='ner')
+            metrics.observe_batch(len(texts[chunk_start:chunk_start + batch_size]), model='ner')
+        ner_results = ner_pipeline(texts, batch_size=batch_size)
+    
+    return [
+        [entity['word'] for entity in entities if "ORG" in entity['entity_group'].upper()]
+        for entities in ner_results
+    ]
+
+def match_esg_keywords(text_lower: str, start: int = 0, end: int = None):
+    """
+    Find ESG keywords inside text_lower[start:end] without slicing it
+    
+    Returns:
+        tuple: (found_keywords, categories_found, subcategories_found)
+    """
+    end = len(text_lower) if end is None else end
+    found_keywords = []
+    categories_found = set()
+    subcategories_found = set()
+    for keyword, category, subcategory in esg_keyword_index:
+        if text_lower.find(keyword, start, end) != -1:
+            found_keywords.append(keyword)
+            categories_found.add(category)
+            subcategories_found.add(subcategory)
+    return found_keywords, categories_found, subcategories_found
+
+PILLAR_FEATURE_PREFIX = {'Environmental': 'env', 'Social': 'social', 'Governance': 'gov'}
+
+# subcategory -> feature suffix, e.g. 'climate_action' -> 'env_climate_action' (pos_/neg_ added per sentiment)
+subcategory_feature_suffix = {
+    subcategory: f'{PILLAR_FEATURE_PREFIX[pillar]}_{subcategory}'
+    for pillar, subcategories in esg_category_mapping.items()
+    for subcategory in subcategories
+}
+
+# subcategory -> pillar, e.g. 'climate_action' -> 'Environmental'
+subcategory_pillar = {
+    subcategory: pillar
+    for pillar, subcategories in esg_category_mapping.items()
+    for subcategory in subcategories
+}
+
+def new_feature_row(filename: str) -> dict:
+    """Zeroed feature row in the column order the models were trained on"""
     features = {
         'filename': filename,
         
@@ -500,208 +744,167 @@ def process_esg_files_working(texts: str, filename: str):
         'pos_gov_innovation_technology': 0, 'neg_gov_innovation_technology': 0,
         'pos_gov_cybersecurity_data': 0, 'neg_gov_cybersecurity_data': 0,
     }
+    return features
+
+def find_esg_candidates(texts: str, page_starts=None):
+    """
+    Segment the document and keep the sentences that contain ESG keywords
+    
+    Returns:
+        tuple: (sentences, candidates); candidates are
+               (sentence_id, start, end, page, found_keywords, categories, subcategories),
+               the sentence text is only sliced when its batch is scored
+    """
+    # Lowercase once per document; offsets only line up if lowercasing keeps the length
+    texts_lower = texts.lower()
+    if len(texts_lower) != len(texts):
+        texts_lower = None
+    
+    with metrics.timer('segment_sentences'):
+        sentences = segment_sentences(texts, page_starts)
+    metrics.inc('sentences_segmented', len(sentences))
+    
+    candidates = []
+    keyword_seconds = 0.0
+    for i, (start, end, page) in enumerate(sentences):
+        if end - start < 10:
+            continue
+        
+        match_start = time.perf_counter()
+        if texts_lower is not None:
+            found_keywords, categories_found, subcategories_found = match_esg_keywords(texts_lower, start, end)
+        else:
+            found_keywords, categories_found, subcategories_found = match_esg_keywords(texts[start:end].lower())
+        keyword_seconds += time.perf_counter() - match_start
+        
+        if found_keywords:
+            metrics.inc('keyword_positive_sentences')
+            candidates.append((i, start, end, page, found_keywords, categories_found, subcategories_found))
+    
+    metrics.record_stage('keyword_matching', keyword_seconds)
+    return sentences, candidates
+
+POSITIVE_THRESHOLD = 0.7
+NEGATIVE_THRESHOLD = 0.5
+
+def sentiment_label(sentiment_score: float) -> str:
+    """'positive' from 0.7, 'negative' below 0.5, 'neutral' in between"""
+    if sentiment_score >= POSITIVE_THRESHOLD:
+        return 'positive'
+    if sentiment_score < NEGATIVE_THRESHOLD:
+        return 'negative'
+    return 'neutral'
+
+def score_esg_candidates(texts: str, candidates, batch_size=None):
+    """
+    Run sentiment + NER over candidates in batches (size adapts to the memory budget, if any)
+    
+    Args:
+        texts (str): Document buffer the candidate offsets point into
+        candidates (list): From find_esg_candidates
+        batch_size (int): Fixed batch size, None to ask sentiment_batcher before every batch
+    
+    Yields:
+        list: One record per candidate of the batch, in order
+    """
+    position = 0
+    while position < len(candidates):
+        batch = candidates[position:position + (batch_size or sentiment_batcher.next_batch_size())]
+        position += len(batch)
+        batch_sentences = [slice_sentence(texts, start, end, max_words=50) for _, start, end, *_ in batch]
+        with tracing.span('batch', cat='batch', size=len(batch), first_sentence_id=batch[0][0]):
+            sentiment_scores = infer_sentiment_batch(batch_sentences)
+            name_lists = extract_organization_names_batch(batch_sentences)
+        
+        records = []
+        for (i, start, end, page, found_keywords, categories_found, subcategories_found), sentence, \
+                sentiment_score, name_list in zip(batch, batch_sentences, sentiment_scores, name_lists):
+            # Sentiment analysis
+            label = sentiment_label(sentiment_score)
+            confidence = sentiment_score if label == 'positive' else (1 - sentiment_score)
+            
+            records.append({
+                'sentence_id': i,
+                'start': start,
+                'end': end,
+                'page': page,
+                'sentence': sentence,
+                'keywords_found': found_keywords,
+                'categories': list(categories_found),
+                'subcategories': list(subcategories_found),
+                'keyword_count': len(found_keywords),
+                'sentiment': label,
+                'sentiment_score': sentiment_score,
+                'confidence': confidence,
+                'organizations': name_list,
+            })
+        yield records
+
+def add_esg_sentence(features: dict, record: dict, weight=1):
+    """Count one scored sentence into the feature row (weight > 1 when extrapolating a sample)"""
+    for name in record['organizations']:
+        if name.lower() not in company_esg_dict:
+            continue
+        else:
+            point = company_esg_dict[name.lower()]
+            if point < 0:
+                features['NER_neg'] += abs(point) * weight
+            else:
+                features['NER_pos'] += abs(point) * weight
+    
+    # Count features based on sentiment and subcategory
+    if record['sentiment'] == 'positive':
+        prefix = 'pos'
+    elif record['sentiment'] == 'negative':
+        prefix = 'neg'
+    else:
+        return
+    for subcategory in record['subcategories']:
+        features[f'{prefix}_{subcategory_feature_suffix[subcategory]}'] += weight
+
+def finalize_features(features: dict) -> dict:
+    """Add the per-pillar totals and ratios"""
+    # Calculate aggregated features
+    env_pos = sum([features[f'pos_env_{sub}'] for sub in ['climate_action', 'energy_transition', 'water_stewardship', 'biodiversity_nature', 'pollution_prevention', 'circular_economy', 'sustainable_practices']])
+    env_neg = sum([features[f'neg_env_{sub}'] for sub in ['climate_action', 'energy_transition', 'water_stewardship', 'biodiversity_nature', 'pollution_prevention', 'circular_economy', 'sustainable_practices']])
+    social_pos = sum([features[f'pos_social_{sub}'] for sub in ['diversity_inclusion', 'workforce_development', 'health_safety', 'human_rights', 'community_engagement', 'customer_stakeholder', 'financial_inclusion']])
+    social_neg = sum([features[f'neg_social_{sub}'] for sub in ['diversity_inclusion', 'workforce_development', 'health_safety', 'human_rights', 'community_engagement', 'customer_stakeholder', 'financial_inclusion']])
+    gov_pos = sum([features[f'pos_gov_{sub}'] for sub in ['corporate_governance', 'ethics_integrity', 'transparency_disclosure', 'risk_management', 'compliance_legal', 'stakeholder_relations', 'innovation_technology', 'cybersecurity_data']])
+    gov_neg = sum([features[f'neg_gov_{sub}'] for sub in ['corporate_governance', 'ethics_integrity', 'transparency_disclosure', 'risk_management', 'compliance_legal', 'stakeholder_relations', 'innovation_technology', 'cybersecurity_data']])
+    
+    # Add aggregated features
+    features.update({
+        'total_pos_environmental': env_pos,
+        'total_neg_environmental': env_neg,
+        'total_pos_social': social_pos,
+        'total_neg_social': social_neg,
+        'total_pos_governance': gov_pos,
+        'total_neg_governance': gov_neg,
+        'total_environmental_mentions': env_pos + env_neg,
+        'total_social_mentions': social_pos + social_neg,
+        'total_governance_mentions': gov_pos + gov_neg,
+        'total_esg_mentions': env_pos + env_neg + social_pos + social_neg + gov_pos + gov_neg,
+        'esg_pos_ratio': (env_pos + social_pos + gov_pos) / max(env_pos + env_neg + social_pos + social_neg + gov_pos + gov_neg, 1),
+        'esg_neg_ratio': (env_neg + social_neg + gov_neg) / max(env_pos + env_neg + social_pos + social_neg + gov_pos + gov_neg, 1),
+    })
+    return features
+
+def process_esg_files_working(texts: str, filename: str, page_starts=None):
+    all_results = []
+    features = new_feature_row(filename)
     
     try:
-        sentences = re.split(r'[.!?]+', texts)
-        features['total_sentences'] = len(sentences)
-        features['total_words'] = len(texts.split())
+        sentences, candidates = find_esg_candidates(texts, page_starts)
+        features['total_sentences'] = count_sentence_fragments(texts)
+        features['total_words'] = count_words(texts)
         features['NER_pos'] = 0
         features['NER_neg'] = 0
-
-        esg_sentences = []
-        esg_count = 0
-        pos_count = 0
-        neg_count = 0
         
-        for i, sentence in enumerate(sentences):
-            sentence = sentence.strip()
-            if len(sentence) < 10:
-                continue
-            
-            sentence_lower = sentence.lower()
-            
-            # Find ESG keywords
-            found_keywords = []
-            for keyword in all_esg_keywords_lower:
-                if keyword in sentence_lower:
-                    found_keywords.append(keyword)
-            
-            if found_keywords:
-                esg_count += 1
-                
-                # Find categories and subcategories
-                categories_found = set()
-                subcategories_found = set()
-                
-                for category, subcategories in esg_keywords.items():
-                    for subcategory, keywords in subcategories.items():
-                        for keyword in keywords:
-                            if keyword.lower() in sentence_lower:
-                                categories_found.add(category)
-                                subcategories_found.add(subcategory)
-                
-                if (len(sentence.split()) > 50):
-                    sentence = ' '.join(sentence.split()[:50])
-                # Sentiment analysis
-                sentiment_score = infer_sentiment(sentence)
-                sentiment_label = 'neutral'
-                
-
-                if sentiment_score >= 0.7:
-                    sentiment_label = 'positive'
-                elif sentiment_score < 0.5:
-                    sentiment_label = 'negative'
-
-                name_list = extract_organization_names(sentence)
-                for name in name_list:
-                    if name.lower() not in company_esg_dict:
-                        continue
-                    else:
-                        point = company_esg_dict[name.lower()]
-                        if point < 0:
-                            features['NER_neg'] += abs(point)
-                        else:
-                            features['NER_pos'] += abs(point)
-
-                confidence = sentiment_score if sentiment_label == 'positive' else (1 - sentiment_score)
-                
-                esg_sentence_data = {
-                    'sentence_id': i,
-                    'sentence': sentence,
-                    'keywords_found': found_keywords,
-                    'categories': list(categories_found),
-                    'subcategories': list(subcategories_found),
-                    'keyword_count': len(found_keywords),
-                    'sentiment': sentiment_label,
-                    'confidence': confidence
-                }
-                
-                # Count features based on sentiment and subcategory
-                if sentiment_label == 'positive':
-                    pos_count += 1
-                    for subcategory in subcategories_found:
-                        # Map subcategory to feature name and increment
-                        if subcategory == 'climate_action':
-                            features['pos_env_climate_action'] += 1
-                        elif subcategory == 'energy_transition':
-                            features['pos_env_energy_transition'] += 1
-                        elif subcategory == 'water_stewardship':
-                            features['pos_env_water_stewardship'] += 1
-                        elif subcategory == 'biodiversity_nature':
-                            features['pos_env_biodiversity_nature'] += 1
-                        elif subcategory == 'pollution_prevention':
-                            features['pos_env_pollution_prevention'] += 1
-                        elif subcategory == 'circular_economy':
-                            features['pos_env_circular_economy'] += 1
-                        elif subcategory == 'sustainable_practices':
-                            features['pos_env_sustainable_practices'] += 1
-                        elif subcategory == 'diversity_inclusion':
-                            features['pos_social_diversity_inclusion'] += 1
-                        elif subcategory == 'workforce_development':
-                            features['pos_social_workforce_development'] += 1
-                        elif subcategory == 'health_safety':
-                            features['pos_social_health_safety'] += 1
-                        elif subcategory == 'human_rights':
-                            features['pos_social_human_rights'] += 1
-                        elif subcategory == 'community_engagement':
-                            features['pos_social_community_engagement'] += 1
-                        elif subcategory == 'customer_stakeholder':
-                            features['pos_social_customer_stakeholder'] += 1
-                        elif subcategory == 'financial_inclusion':
-                            features['pos_social_financial_inclusion'] += 1
-                        elif subcategory == 'corporate_governance':
-                            features['pos_gov_corporate_governance'] += 1
-                        elif subcategory == 'ethics_integrity':
-                            features['pos_gov_ethics_integrity'] += 1
-                        elif subcategory == 'transparency_disclosure':
-                            features['pos_gov_transparency_disclosure'] += 1
-                        elif subcategory == 'risk_management':
-                            features['pos_gov_risk_management'] += 1
-                        elif subcategory == 'compliance_legal':
-                            features['pos_gov_compliance_legal'] += 1
-                        elif subcategory == 'stakeholder_relations':
-                            features['pos_gov_stakeholder_relations'] += 1
-                        elif subcategory == 'innovation_technology':
-                            features['pos_gov_innovation_technology'] += 1
-                        elif subcategory == 'cybersecurity_data':
-                            features['pos_gov_cybersecurity_data'] += 1
-                            
-                elif sentiment_label == 'negative':
-                    neg_count += 1
-                    for subcategory in subcategories_found:
-                        # Map subcategory to feature name and increment
-                        if subcategory == 'climate_action':
-                            features['neg_env_climate_action'] += 1
-                        elif subcategory == 'energy_transition':
-                            features['neg_env_energy_transition'] += 1
-                        elif subcategory == 'water_stewardship':
-                            features['neg_env_water_stewardship'] += 1
-                        elif subcategory == 'biodiversity_nature':
-                            features['neg_env_biodiversity_nature'] += 1
-                        elif subcategory == 'pollution_prevention':
-                            features['neg_env_pollution_prevention'] += 1
-                        elif subcategory == 'circular_economy':
-                            features['neg_env_circular_economy'] += 1
-                        elif subcategory == 'sustainable_practices':
-                            features['neg_env_sustainable_practices'] += 1
-                        elif subcategory == 'diversity_inclusion':
-                            features['neg_social_diversity_inclusion'] += 1
-                        elif subcategory == 'workforce_development':
-                            features['neg_social_workforce_development'] += 1
-                        elif subcategory == 'health_safety':
-                            features['neg_social_health_safety'] += 1
-                        elif subcategory == 'human_rights':
-                            features['neg_social_human_rights'] += 1
-                        elif subcategory == 'community_engagement':
-                            features['neg_social_community_engagement'] += 1
-                        elif subcategory == 'customer_stakeholder':
-                            features['neg_social_customer_stakeholder'] += 1
-                        elif subcategory == 'financial_inclusion':
-                            features['neg_social_financial_inclusion'] += 1
-                        elif subcategory == 'corporate_governance':
-                            features['neg_gov_corporate_governance'] += 1
-                        elif subcategory == 'ethics_integrity':
-                            features['neg_gov_ethics_integrity'] += 1
-                        elif subcategory == 'transparency_disclosure':
-                            features['neg_gov_transparency_disclosure'] += 1
-                        elif subcategory == 'risk_management':
-                            features['neg_gov_risk_management'] += 1
-                        elif subcategory == 'compliance_legal':
-                            features['neg_gov_compliance_legal'] += 1
-                        elif subcategory == 'stakeholder_relations':
-                            features['neg_gov_stakeholder_relations'] += 1
-                        elif subcategory == 'innovation_technology':
-                            features['neg_gov_innovation_technology'] += 1
-                        elif subcategory == 'cybersecurity_data':
-                            features['neg_gov_cybersecurity_data'] += 1
-                
-                esg_sentences.append(esg_sentence_data)
-        
-        # Calculate aggregated features
-        env_pos = sum([features[f'pos_env_{sub}'] for sub in ['climate_action', 'energy_transition', 'water_stewardship', 'biodiversity_nature', 'pollution_prevention', 'circular_economy', 'sustainable_practices']])
-        env_neg = sum([features[f'neg_env_{sub}'] for sub in ['climate_action', 'energy_transition', 'water_stewardship', 'biodiversity_nature', 'pollution_prevention', 'circular_economy', 'sustainable_practices']])
-        social_pos = sum([features[f'pos_social_{sub}'] for sub in ['diversity_inclusion', 'workforce_development', 'health_safety', 'human_rights', 'community_engagement', 'customer_stakeholder', 'financial_inclusion']])
-        social_neg = sum([features[f'neg_social_{sub}'] for sub in ['diversity_inclusion', 'workforce_development', 'health_safety', 'human_rights', 'community_engagement', 'customer_stakeholder', 'financial_inclusion']])
-        gov_pos = sum([features[f'pos_gov_{sub}'] for sub in ['corporate_governance', 'ethics_integrity', 'transparency_disclosure', 'risk_management', 'compliance_legal', 'stakeholder_relations', 'innovation_technology', 'cybersecurity_data']])
-        gov_neg = sum([features[f'neg_gov_{sub}'] for sub in ['corporate_governance', 'ethics_integrity', 'transparency_disclosure', 'risk_management', 'compliance_legal', 'stakeholder_relations', 'innovation_technology', 'cybersecurity_data']])
-        
-        # Add aggregated features
-        features.update({
-            'total_pos_environmental': env_pos,
-            'total_neg_environmental': env_neg,
-            'total_pos_social': social_pos,
-            'total_neg_social': social_neg,
-            'total_pos_governance': gov_pos,
-            'total_neg_governance': gov_neg,
-            'total_environmental_mentions': env_pos + env_neg,
-            'total_social_mentions': social_pos + social_neg,
-            'total_governance_mentions': gov_pos + gov_neg,
-            'total_esg_mentions': env_pos + env_neg + social_pos + social_neg + gov_pos + gov_neg,
-            'esg_pos_ratio': (env_pos + social_pos + gov_pos) / max(env_pos + env_neg + social_pos + social_neg + gov_pos + gov_neg, 1),
-            'esg_neg_ratio': (env_neg + social_neg + gov_neg) / max(env_pos + env_neg + social_pos + social_neg + gov_pos + gov_neg, 1),
-        })
-        
-        all_results.append(features)
+        for records in score_esg_candidates(texts, candidates):
+            for record in records:
+                add_esg_sentence(features, record)
+        
+        all_results.append(finalize_features(features))
         
     except Exception as e:
         print(f"  ❌ Lỗi: {e}")
@@ -716,6 +919,255 @@ def process_esg_files_working(texts: str, filename: str):
     
     return df_all_files
 
+# ===== DEADLINE-AWARE (ANYTIME) SCORING =====
+# Headings that open the sustainability / ESG part of an annual report
+ESG_SECTION_MARKERS = [
+    'phát triển bền vững', 'báo cáo bền vững', 'trách nhiệm xã hội', 'môi trường và xã hội',
+    'quản trị công ty', 'quản trị rủi ro', 'esg', 'sustainability', 'sustainable development',
+    'corporate social responsibility', 'corporate governance',
+]
+
+def distinct_keywords(found_keywords) -> list:
+    """
+    Keyword hits without duplicates (a keyword listed under two subcategories) and without
+    hits contained in a longer hit ('phát thải' inside 'giảm phát thải')
+    """
+    unique = set(found_keywords)
+    return [keyword for keyword in unique
+            if not any(keyword != other and keyword in other for other in unique)]
+
+def find_esg_section_pages(texts: str, page_starts=None, follow_pages=3) -> set:
+    """Pages under an ESG heading (a short line with a section marker) and the follow_pages after it"""
+    if not page_starts:
+        return set()
+    pages = set()
+    for line in re.finditer(r'[^\n]+', texts):
+        if len(line.group()) > 80:
+            continue
+        line_lower = line.group().lower()
+        if any(marker in line_lower for marker in ESG_SECTION_MARKERS):
+            page = bisect.bisect_right(page_starts, line.start())
+            pages.update(range(page, page + follow_pages + 1))
+    return pages
+
+class AnytimeScorer:
+    """
+    Score a document in priority order so that a usable result exists at any point
+    
+    Keyword-dense (2+ distinct keywords) and ESG-section sentences form the priority stratum, scored
+    first; the rest is visited round-robin over strata (the ESG pillars of the sentence), each
+    stratum in random order. Scored sentences are counted exactly. The subcategories of every
+    unscored sentence are already known from keyword matching, so each of its subcategory mentions
+    adds the estimated share of positive / negative mentions of that pillar: from the sentence's
+    own stratum once it is sampled, otherwise from all scored mentions of the pillar.
+    """
+    PRIORITY = 'priority'
+    
+    def __init__(self, texts: str, filename: str, page_starts=None, seed=0):
+        self.filename = filename
+        self.texts = texts
+        self.started = time.perf_counter()
+        
+        self.base = new_feature_row(filename)
+        sentences, candidates = find_esg_candidates(texts, page_starts)
+        self.base['total_sentences'] = count_sentence_fragments(texts)
+        self.base['total_words'] = count_words(texts)
+        self.base['NER_pos'] = 0
+        self.base['NER_neg'] = 0
+        
+        section_pages = find_esg_section_pages(texts, page_starts)
+        strata = {}
+        for candidate in candidates:
+            if len(distinct_keywords(candidate[4])) >= 2 or candidate[3] in section_pages:
+                key = self.PRIORITY
+            else:
+                key = '+'.join(sorted(candidate[5]))
+            strata.setdefault(key, []).append(candidate)
+        self.stratum_sizes = {key: len(members) for key, members in strata.items()}
+        
+        # Random order inside the priority stratum too, a partial run of it has to be a fair sample
+        rng = random.Random(seed)
+        priority = strata.pop(self.PRIORITY, [])
+        rng.shuffle(priority)
+        self.order = [(self.PRIORITY, candidate) for candidate in priority]
+        queues = []
+        for key in sorted(strata):
+            rng.shuffle(strata[key])
+            queues.append((key, deque(strata[key])))
+        while queues:
+            for key, queue in queues:
+                self.order.append((key, queue.popleft()))
+            queues = [(key, queue) for key, queue in queues if queue]
+        
+        self.scored_counts = {name: 0 for name in self.base if name.startswith(('pos_', 'neg_', 'NER_'))}
+        self.stratum_scored = {key: 0 for key in self.stratum_sizes}
+        # (stratum or None, pillar or None) -> [positive, negative, all] subcategory mentions scored
+        self.mention_stats = {}
+        # stratum or None -> [NER_pos, NER_neg, sentences] scored
+        self.ner_stats = {}
+        self.records = []
+        self.position = 0
+        self.lock = threading.Lock()
+    
+    @property
+    def done(self):
+        return self.position >= len(self.order)
+    
+    def run(self, deadline=None, reserve_s=0.0):
+        """
+        Score batches until the end of the document or until the next batch would cross the deadline
+        
+        Args:
+            deadline (float): time.perf_counter() value, None to run to the end
+            reserve_s (float): Time kept free for clustering and E/S/G scoring
+        """
+        with self.lock:
+            batch_seconds = 0.0
+            while not self.done:
+                if deadline is not None and time.perf_counter() + batch_seconds + reserve_s > deadline:
+                    break
+                batch_start = time.perf_counter()
+                batch = self.order[self.position:self.position + sentiment_batcher.next_batch_size()]
+                records = [record for records in score_esg_candidates(self.texts, [c for _, c in batch], len(batch))
+                           for record in records]
+                for (key, _), record in zip(batch, records):
+                    self.add_scored(key, record)
+                self.records.extend(records)
+                self.position += len(batch)
+                batch_seconds = time.perf_counter() - batch_start
+        return self
+    
+    def add_scored(self, key, record):
+        """Count a scored sentence exactly and into the sentiment / NER rate estimates"""
+        ner_before = (self.scored_counts['NER_pos'], self.scored_counts['NER_neg'])
+        add_esg_sentence(self.scored_counts, record)
+        self.stratum_scored[key] += 1
+        
+        for stats_key in (key, None):
+            ner = self.ner_stats.setdefault(stats_key, [0, 0, 0])
+            ner[0] += self.scored_counts['NER_pos'] - ner_before[0]
+            ner[1] += self.scored_counts['NER_neg'] - ner_before[1]
+            ner[2] += 1
+        for subcategory in record['subcategories']:
+            pillar = subcategory_pillar[subcategory]
+            for stats_key in ((key, pillar), (None, pillar), (None, None)):
+                stats = self.mention_stats.setdefault(stats_key, [0, 0, 0])
+                stats[0] += record['sentiment'] == 'positive'
+                stats[1] += record['sentiment'] == 'negative'
+                stats[2] += 1
+    
+    def sentiment_rates(self, key, pillar):
+        """(share positive, share negative) of the pillar's mentions in stratum key, falling back to all strata"""
+        for stats_key in ((key, pillar), (None, pillar), (None, None)):
+            stats = self.mention_stats.get(stats_key)
+            if stats:
+                return stats[0] / stats[2], stats[1] / stats[2]
+        return 0.0, 0.0
+    
+    def ner_rates(self, key):
+        """Mean NER_pos / NER_neg per sentence in stratum key, falling back to all strata"""
+        for stats_key in (key, None):
+            stats = self.ner_stats.get(stats_key)
+            if stats:
+                return stats[0] / stats[2], stats[1] / stats[2]
+        return 0.0, 0.0
+    
+    def features(self):
+        """Feature row: scored sentences counted exactly plus the expected counts of the rest (exact once done)"""
+        features = dict(self.base)
+        for name, value in self.scored_counts.items():
+            features[name] += value
+        
+        for key, candidate in self.order[self.position:]:
+            for subcategory in candidate[6]:
+                positive, negative = self.sentiment_rates(key, subcategory_pillar[subcategory])
+                features[f'pos_{subcategory_feature_suffix[subcategory]}'] += positive
+                features[f'neg_{subcategory_feature_suffix[subcategory]}'] += negative
+            ner_pos, ner_neg = self.ner_rates(key)
+            features['NER_pos'] += ner_pos
+            features['NER_neg'] += ner_neg
+        return pd.DataFrame([finalize_features(features)])
+    
+    def coverage(self):
+        total = len(self.order)
+        scored = self.position
+        fraction = scored / total if total else 1.0
+        observed = sum(1 for key in self.stratum_sizes if self.stratum_scored[key] > 0)
+        priority_complete = self.stratum_scored.get(self.PRIORITY, 0) == self.stratum_sizes.get(self.PRIORITY, 0)
+        
+        # Sampling error of a proportion with finite population correction
+        if scored == total:
+            relative_error = 0.0
+        elif scored == 0:
+            relative_error = None
+        else:
+            relative_error = math.sqrt((1 - fraction) / scored)
+        
+        if self.done:
+            confidence = 'complete'
+        elif not priority_complete:
+            # Everything outside the priority stratum is still guessed from pooled rates
+            confidence = 'low'
+        elif fraction >= 0.8 or (fraction >= 0.3 and observed == len(self.stratum_sizes)):
+            confidence = 'high'
+        elif fraction >= 0.1 and observed > 0:
+            confidence = 'medium'
+        else:
+            confidence = 'low'
+        
+        return {
+            'esg_sentences_total': total,
+            'esg_sentences_scored': scored,
+            'coverage': round(fraction, 4),
+            'strata_total': len(self.stratum_sizes),
+            'strata_observed': observed,
+            'priority_complete': priority_complete,
+            'estimated_relative_error': None if relative_error is None else round(relative_error, 4),
+            'confidence': confidence,
+            'complete': self.done,
+            'elapsed_s': round(time.perf_counter() - self.started, 3),
+        }
+
+def clean_company_name(name):
+    prefixes = ['Công ty CP', 'Công ty Cổ phần', 'Công ty TNHH', 'Tập đoàn', 'Ngân hàng TMCP', 'Ngân hàng', 'Công ty']
+    prefixes.sort(key=len, reverse=True)
+    for prefix in prefixes:
+        if name.startswith(prefix):
+            name = name[len(prefix):].strip()
+            break # Remove only one prefix
+    return name
+
+def load_company_esg_dict(csv_path='company_esg.csv'):
+    """Map lowercase company name -> ESG score centered on 0 (used for NER_pos / NER_neg)"""
+    df = pd.read_csv(csv_path)
+    df['company_name'] = df['company_name'].apply(clean_company_name)
+
+    company_esg_dict = {}
+    for index, row in df.iterrows():
+        company_esg_dict[row['company_name'].lower()] = row[' esg_score'] - 2.5
+    return company_esg_dict
+
+def load_cluster_reference(train_csv='esg_features_with_ner_scores.csv'):
+    """
+    Build what assign_cluster needs from the labeled training features
+    
+    Returns:
+        tuple: (feature_cols, cluster_centroids, scaler)
+    """
+    df_train = pd.read_csv(train_csv)
+
+    feature_cols = [col for col in df_train.columns if col not in 
+                ['filename', 'esg_tier', 'esg_cluster', 'e_score', 's_score', 'g_score']]
+
+    cluster_centroids = {}
+    for cluster in df_train['esg_cluster'].unique():
+        cluster_data = df_train[df_train['esg_cluster'] == cluster]
+        cluster_centroids[cluster] = cluster_data[feature_cols].mean()
+
+    scaler = StandardScaler()
+    scaler.fit(df_train[feature_cols])
+    return feature_cols, cluster_centroids, scaler
+
 def assign_cluster(df_new, feature_cols, cluster_centroids, scaler):
     df_new_scaled = scaler.transform(df_new[feature_cols])
     
@@ -733,6 +1185,32 @@ def assign_cluster(df_new, feature_cols, cluster_centroids, scaler):
     
     return assigned_cluster
 
+ESG_SCORE_MODEL_FILES = [
+    'xgboost_e_score_model.pkl', 'xgboost_s_score_model.pkl', 'xgboost_g_score_model.pkl',
+    'xgboost_scaler.pkl', 'xgboost_encoders.pkl', 'xgboost_features.pkl'
+]
+_esg_score_models = {}
+
+def load_esg_score_models(model_path):
+    """
+    Load the saved E/S/G models and preprocessing objects, cached until a file changes on disk
+    
+    Returns:
+        tuple: (e_model, s_model, g_model, scaler, label_encoders, feature_names)
+    """
+    paths = [f'{model_path}{name}' for name in ESG_SCORE_MODEL_FILES]
+    key = (model_path, tuple(os.path.getmtime(path) for path in paths))  # FileNotFoundError if missing
+    if key in _esg_score_models:
+        metrics.inc('cache_hits', cache='esg_score_models')
+        return _esg_score_models[key]
+    
+    metrics.inc('cache_misses', cache='esg_score_models')
+    with tracing.span('load_esg_score_models', cat='load'):
+        loaded = tuple(joblib.load(path) for path in paths)
+    _esg_score_models.clear()
+    _esg_score_models[key] = loaded
+    return loaded
+
 def infer_esg_scores(df, model_path='d:/Jupyter/hackathon_techcombank/'):
     """
     Inference function to predict E, S, G scores from input dataframe
@@ -754,12 +1232,7 @@ def infer_esg_scores(df, model_path='d:/Jupyter/hackathon_techcombank/'):
     
     # Load saved models and preprocessing objects
     try:
-        e_model = joblib.load(f'{model_path}xgboost_e_score_model.pkl')
-        s_model = joblib.load(f'{model_path}xgboost_s_score_model.pkl')
-        g_model = joblib.load(f'{model_path}xgboost_g_score_model.pkl')
-        scaler = joblib.load(f'{model_path}xgboost_scaler.pkl')
-        label_encoders = joblib.load(f'{model_path}xgboost_encoders.pkl')
-        feature_names = joblib.load(f'{model_path}xgboost_features.pkl')
+        e_model, s_model, g_model, scaler, label_encoders, feature_names = load_esg_score_models(model_path)
         
         print("Models loaded successfully!")
         
@@ -811,12 +1284,16 @@ def infer_esg_scores(df, model_path='d:/Jupyter/hackathon_techcombank/'):
     print(f"Processed features shape: {X.shape}")
     
     # Scale features
-    X_scaled = scaler.transform(X)
+    with tracing.span('scaler_transform', cat='model'):
+        X_scaled = scaler.transform(X)
     
     # Make predictions
-    e_scores = e_model.predict(X_scaled)
-    s_scores = s_model.predict(X_scaled)
-    g_scores = g_model.predict(X_scaled)
+    with tracing.span('predict_e_score', cat='model'):
+        e_scores = e_model.predict(X_scaled)
+    with tracing.span('predict_s_score', cat='model'):
+        s_scores = s_model.predict(X_scaled)
+    with tracing.span('predict_g_score', cat='model'):
+        g_scores = g_model.predict(X_scaled)
     
     # Create results dataframe
     results_df = pd.DataFrame({
@@ -830,60 +1307,555 @@ def infer_esg_scores(df, model_path='d:/Jupyter/hackathon_techcombank/'):
     
     return results_df
 
-if __name__ == "__main__":
-    stored_text = pdf_to_text('D:/Jupyter/hackathon_techcombank/esg_report_pdf/AR SAB 2023.pdf')
+# ===== SCORING PIPELINE =====
+SENTIMENT_MODEL_PATH = os.environ.get('ESG_SENTIMENT_MODEL', 'sentiment_regressor_complete.pth')
+NER_MODEL_NAME = os.environ.get('ESG_NER_MODEL', 'NlpHUST/ner-vietnamese-electra-base')
+ESG_MODEL_PATH = os.environ.get('ESG_MODEL_PATH', 'd:/Jupyter/hackathon_techcombank/')
+RESULTS_DB = os.environ.get('ESG_RESULTS_DB', 'esg_results.db')
+
+BATCH_SIZE = int(os.environ.get('ESG_BATCH_SIZE', 16))
+MAX_BATCH_SIZE = int(os.environ.get('ESG_MAX_BATCH_SIZE', 64))
+
+model, tokenizer, device = None, None, None
+ner_pipeline = None
+company_esg_dict = {}
+cluster_reference = None
+store = None
+store_lock = threading.Lock()
+
+memory_budget = MemoryBudget.from_env()
+sentiment_batcher = AdaptiveBatcher('sentiment', BATCH_SIZE, MAX_BATCH_SIZE, seq_len=128, budget=memory_budget)
+ner_batcher = AdaptiveBatcher('ner', BATCH_SIZE, MAX_BATCH_SIZE, seq_len=256, budget=memory_budget)
+
+def set_memory_limit(limit_mb):
+    """Turn on memory-budget mode (same as ESG_MEMORY_LIMIT_MB)"""
+    global memory_budget
+    memory_budget = MemoryBudget(int(limit_mb * 2**20))
+    sentiment_batcher.budget = memory_budget
+    ner_batcher.budget = memory_budget
+
+def load_pipeline(sentiment_model_path=SENTIMENT_MODEL_PATH, ner_model_name=NER_MODEL_NAME):
+    """Load every model and lookup table the pipeline reads as module globals, returns seconds spent"""
+    global model, tokenizer, device, ner_pipeline, company_esg_dict, cluster_reference
+    start_time = time.perf_counter()
+
+    with tracing.span('load_sentiment_model', cat='load'):
+        model, tokenizer, device = load_sentiment_model(sentiment_model_path)
+
+    print(f"Loading tokenizer and model: {ner_model_name}...")
+    with tracing.span('load_ner_model', cat='load'):
+        ner_tokenizer = AutoTokenizer.from_pretrained(ner_model_name)
+        model_ner = AutoModelForTokenClassification.from_pretrained(ner_model_name)
+        ner_pipeline = pipeline("ner", model=model_ner, tokenizer=ner_tokenizer, device='cpu', grouped_entities=True)
+
+    # Activation estimates for the memory budget
+    if model is not None:
+        sentiment_batcher.config = model.config
+    ner_batcher.config = model_ner.config
+
+    with tracing.span('load_lookup_tables', cat='load'):
+        company_esg_dict = load_company_esg_dict('company_esg.csv')
+        cluster_reference = load_cluster_reference('esg_features_with_ner_scores.csv')
+    return time.perf_counter() - start_time
+
+def model_version(esg_model_path=ESG_MODEL_PATH):
+    """Short hash of every model the scores depend on: sentiment, NER, E/S/G models and preprocessing"""
+    return file_version(SENTIMENT_MODEL_PATH, NER_MODEL_NAME,
+                        *(f'{esg_model_path}{name}' for name in ESG_SCORE_MODEL_FILES))
+
+def score_features(df_all_files, esg_model_path=ESG_MODEL_PATH, timings=None):
+    """
+    Cluster + E/S/G scores for a feature row from process_esg_files_working / AnytimeScorer
     
-    model, tokenizer, device = load_sentiment_model()
-    model_name = "NlpHUST/ner-vietnamese-electra-base" 
+    Returns:
+        dict: features (DataFrame, one row), esg_cluster, scores (DataFrame or None), timings (seconds per stage)
+    """
+    timings = {} if timings is None else timings
 
-    print(f"Loading tokenizer and model: {model_name}...")
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model_ner = AutoModelForTokenClassification.from_pretrained(model_name)
+    feature_cols, cluster_centroids, scaler = cluster_reference
+    with metrics.timer('assign_cluster') as t:
+        assigned_cluster = assign_cluster(df_all_files, feature_cols, cluster_centroids, scaler)
+    timings['assign_cluster'] = t.elapsed
+    df_all_files['esg_cluster'] = assigned_cluster
 
-    ner_pipeline = pipeline("ner", model=model_ner, tokenizer=tokenizer, device='cpu', grouped_entities=True)
+    with metrics.timer('infer_esg_scores') as t:
+        inferred_scores = infer_esg_scores(df_all_files, model_path=esg_model_path)
+    timings['infer_esg_scores'] = t.elapsed
+    metrics.observe_peak('rss_bytes', current_rss())
 
-    df = pd.read_csv('company_esg.csv')
+    return {
+        'features': df_all_files,
+        'esg_cluster': assigned_cluster,
+        'scores': inferred_scores,
+        'timings': timings,
+    }
 
-    import re
+def score_document(texts: str, filename: str, page_starts=None, esg_model_path=ESG_MODEL_PATH):
+    """
+    Run features -> cluster -> E/S/G scores for one document
+    
+    Returns:
+        dict: see score_features
+    """
+    timings = {}
 
-    def clean_company_name(name):
-        prefixes = ['Công ty CP', 'Công ty Cổ phần', 'Công ty TNHH', 'Tập đoàn', 'Ngân hàng TMCP', 'Ngân hàng', 'Công ty']
-        prefixes.sort(key=len, reverse=True)
-        for prefix in prefixes:
-            if name.startswith(prefix):
-                name = name[len(prefix):].strip()
-                break # Remove only one prefix
-        return name
+    with metrics.timer('process_esg_files_working') as t:
+        df_all_files = process_esg_files_working(texts, filename, page_starts)
+    timings['process_esg_files_working'] = t.elapsed
+    if df_all_files is None:
+        raise ValueError(f"Feature extraction failed for {filename}")
 
-    df['company_name'] = df['company_name'].apply(clean_company_name)
+    return score_features(df_all_files, esg_model_path, timings)
 
-    company_esg_dict = {}
-    for index, row in df.iterrows():
-        company_esg_dict[row['company_name'].lower()] = row[' esg_score'] - 2.5
+def score_document_anytime(texts: str, filename: str, page_starts=None, deadline_s=10.0,
+                           esg_model_path=ESG_MODEL_PATH, reserve_s=0.5):
+    """
+    Like score_document, but returns within about deadline_s seconds
+    
+    Features are extrapolated from the sentences scored in time; result['coverage'] says how
+    much was scored and how far to trust it, result['scorer'] can be run() further to refine.
+    """
+    deadline = time.perf_counter() + deadline_s
+    timings = {}
 
-    df_all_files = process_esg_files_working(stored_text, 'filename')
+    with metrics.timer('process_esg_files_anytime') as t:
+        scorer = AnytimeScorer(texts, filename, page_starts)
+        scorer.run(deadline, reserve_s)
+    timings['process_esg_files_anytime'] = t.elapsed
 
-    df_train = pd.read_csv('esg_features_with_ner_scores.csv')
+    result = score_features(scorer.features(), esg_model_path, timings)
+    result['coverage'] = scorer.coverage()
+    result['scorer'] = scorer
+    return result
 
-    feature_cols = [col for col in df_train.columns if col not in 
-                ['filename', 'esg_tier', 'esg_cluster', 'e_score', 's_score', 'g_score']]
+RUNNING_TOTAL_COLUMNS = [
+    'total_pos_environmental', 'total_neg_environmental',
+    'total_pos_social', 'total_neg_social',
+    'total_pos_governance', 'total_neg_governance',
+    'total_esg_mentions', 'esg_pos_ratio', 'esg_neg_ratio', 'NER_pos', 'NER_neg',
+]
 
-    cluster_centroids = {}
-    for cluster in df_train['esg_cluster'].unique():
-        cluster_data = df_train[df_train['esg_cluster'] == cluster]
-        cluster_centroids[cluster] = cluster_data[feature_cols].mean()
+def sentence_event(record, page_starts=None):
+    """NDJSON 'sentence' record: the evidence behind one ESG sentence"""
+    event = {'type': 'sentence', **record}
+    event['categories'] = sorted(record['categories'])
+    event['subcategories'] = sorted(record['subcategories'])
+    if page_starts and record['page']:
+        # Offsets within the page, for highlighting in a page viewer
+        page_start = page_starts[record['page'] - 1]
+        event['page_start'] = record['start'] - page_start
+        event['page_end'] = record['end'] - page_start
+    event['matched_companies'] = [
+        {'name': name, 'esg_point': company_esg_dict[name.lower()]}
+        for name in record['organizations'] if name.lower() in company_esg_dict
+    ]
+    return event
 
-    scaler = StandardScaler()
-    scaler.fit(df_train[feature_cols])
+def stream_document(texts: str, filename: str, page_starts=None, esg_model_path=ESG_MODEL_PATH):
+    """
+    Score one document incrementally
+    
+    Yields dicts, one NDJSON line each:
+        {'type': 'start', ...}      sentence / ESG-sentence counts, before any model call
+        {'type': 'sentence', ...}   every ESG sentence as soon as its batch is scored
+        {'type': 'totals', ...}     running pillar totals after each batch
+        {'type': 'scores', ...}     final features, cluster and E/S/G scores
+    Sentence text is sliced per batch and records are not kept, only offsets and the feature row.
+    """
+    timings = {}
+    features = new_feature_row(filename)
 
-    assigned_cluster = assign_cluster(df_all_files, feature_cols, cluster_centroids, scaler)
+    with metrics.timer('find_esg_candidates') as t:
+        sentences, candidates = find_esg_candidates(texts, page_starts)
+    timings['find_esg_candidates'] = t.elapsed
+    features['total_sentences'] = count_sentence_fragments(texts)
+    features['total_words'] = count_words(texts)
+    features['NER_pos'] = 0
+    features['NER_neg'] = 0
+    yield {
+        'type': 'start',
+        'filename': filename,
+        'pages': len(page_starts) if page_starts else None,
+        'total_sentences': features['total_sentences'],
+        'segmented_sentences': len(sentences),
+        'esg_sentences': len(candidates),
+    }
 
-    df_all_files['esg_cluster'] = assigned_cluster
+    scored = 0
+    with metrics.timer('score_esg_sentences') as t:
+        for records in score_esg_candidates(texts, candidates):
+            for record in records:
+                add_esg_sentence(features, record)
+                yield sentence_event(record, page_starts)
+            scored += len(records)
+            totals = finalize_features(dict(features))
+            yield {
+                'type': 'totals',
+                'esg_sentences_scored': scored,
+                'esg_sentences_total': len(candidates),
+                **{name: totals[name] for name in RUNNING_TOTAL_COLUMNS},
+            }
+    timings['score_esg_sentences'] = t.elapsed
+
+    result = score_features(pd.DataFrame([finalize_features(features)]), esg_model_path, timings)
+    yield {'type': 'scores', 'result': result}
+
+def store_result(result, esg_model_path=ESG_MODEL_PATH, company=None, ticker=None, year=None):
+    """
+    Append a score_document result to the results store, returns the document id
+    
+    company / ticker / year are the store's lookup keys; ticker and year fall back to the filename
+    """
+    global store
+    if store is None:
+        with store_lock:
+            if store is None:
+                store = ResultsStore(RESULTS_DB)
+    scores = result['scores']
+    return store.append(
+        result['features'].iloc[0].to_dict(),
+        scores=scores.iloc[0].to_dict() if scores is not None else None,
+        esg_cluster=result['esg_cluster'],
+        company=company,
+        ticker=ticker,
+        year=year,
+        model_version=model_version(esg_model_path),
+        taxonomy_version=taxonomy_version(esg_keywords),
+        timings=result['timings'],
+    )
+
+def to_jsonable(value):
+    """numpy / pandas scalars -> plain Python for jsonify"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def result_to_response(filename, result):
+    """JSON-ready view of a score_document / score_document_anytime result"""
+    response = {
+        'filename': filename,
+        'esg_cluster': to_jsonable(result['esg_cluster']),
+        'features': {k: to_jsonable(v) for k, v in result['features'].iloc[0].to_dict().items()},
+        'scores': None if result['scores'] is None else {
+            k: to_jsonable(v) for k, v in result['scores'].iloc[0].to_dict().items()
+        },
+        'timings': result['timings'],
+    }
+    if 'coverage' in result:
+        response['coverage'] = result['coverage']
+    return response
+
+# ===== SCORING SERVICE =====
+app = Flask(__name__)
+
+def parse_document_info(fields):
+    """{'company', 'ticker', 'year'} from request fields (JSON body or multipart form), missing ones None"""
+    year = fields.get('year')
+    if year in (None, ''):
+        year = None
+    else:
+        try:
+            year = int(year)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid year: {year!r}")
+    return {
+        'company': fields.get('company') or None,
+        'ticker': fields.get('ticker') or None,
+        'year': year,
+    }
+
+def read_score_request():
+    """
+    (filename, texts, page_starts, document_info) from a PDF upload or a JSON body with 'text' / 'pages'
+    
+    document_info holds the optional 'company', 'ticker' and 'year' fields (form fields next to
+    the upload, or keys of the JSON body) that results-store lookups use.
+    """
+    if 'file' in request.files:
+        document_info = parse_document_info(request.form)
+        upload = request.files['file']
+        filename = upload.filename or 'upload.pdf'
+        texts, page_starts = join_pages(read_pdf_pages_with_pdfplumber(upload.stream))
+        if not texts.strip():
+            raise ValueError("No text extracted from PDF")
+    else:
+        payload = request.get_json(force=True)
+        document_info = parse_document_info(payload)
+        filename = payload.get('filename', 'request')
+        if payload.get('pages') is not None:
+            metrics.inc('pages_extracted', len(payload['pages']))
+            texts, page_starts = join_pages(payload['pages'])
+        else:
+            texts, page_starts = payload.get('text', ''), None
+        if not texts.strip():
+            raise ValueError("Request has no text")
+    return filename, texts, page_starts, document_info
+
+MAX_REFINEMENT_JOBS = 100
+REFINEMENT_WORKERS = int(os.environ.get('ESG_REFINEMENT_WORKERS', 1))
+MAX_PENDING_REFINEMENTS = int(os.environ.get('ESG_MAX_PENDING_REFINEMENTS', 16))
+# Deadline requests wait at most this share of their budget for memory admission, then go ahead
+ADMISSION_WAIT_SHARE = 0.5
+
+refinement_jobs = {}   # job_id -> {'status': 'queued' | 'running' | 'done' | 'failed', ...}
+refinement_lock = threading.Lock()
+refinement_slots = threading.BoundedSemaphore(REFINEMENT_WORKERS)
+pending_refinements = 0
+
+def refine_in_background(filename, scorer, save=True, document_info=None):
+    """
+    Finish an anytime scorer in a thread; poll GET /score/jobs/<job_id> for the refined result
+    
+    At most REFINEMENT_WORKERS refinements run at once so they do not crowd out foreground
+    requests; returns None (no refinement) when MAX_PENDING_REFINEMENTS are already queued.
+    """
+    global pending_refinements
+    job_id = uuid.uuid4().hex
+    with refinement_lock:
+        if pending_refinements >= MAX_PENDING_REFINEMENTS:
+            metrics.inc('refinements_skipped')
+            return None
+        pending_refinements += 1
+        while len(refinement_jobs) >= MAX_REFINEMENT_JOBS:
+            refinement_jobs.pop(next(iter(refinement_jobs)))
+        refinement_jobs[job_id] = {'status': 'queued', 'filename': filename}
+
+    def refine():
+        global pending_refinements
+        job = {'status': 'failed', 'filename': filename, 'error': 'refinement did not start'}
+        try:
+            with refinement_slots:
+                with refinement_lock:
+                    refinement_jobs[job_id] = {'status': 'running', 'filename': filename}
+                job = run_refinement(filename, scorer, save, document_info)
+        finally:
+            with refinement_lock:
+                pending_refinements -= 1
+                refinement_jobs[job_id] = job
+
+    threading.Thread(target=refine, daemon=True).start()
+    return job_id
+
+def run_refinement(filename, scorer, save=True, document_info=None):
+    """Run an anytime scorer to the end, returns the job entry for /score/jobs"""
+    try:
+        with admission(memory_budget), metrics.timer('refine'):
+            scorer.run()
+            result = score_features(scorer.features())
+            result['coverage'] = scorer.coverage()
+        job = {'status': 'done', 'filename': filename, 'result': result_to_response(filename, result)}
+        if save:
+            job['result']['document_id'] = store_result(result, **(document_info or {}))
+    except Exception as e:
+        print(f"❌ Refinement failed for {filename}: {e}")
+        job = {'status': 'failed', 'filename': filename, 'error': str(e)}
+    return job
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok' if model is not None else 'loading', 'pid': os.getpid()})
+
+@app.route('/score', methods=['POST'])
+def score():
+    """
+    Score one report
+    
+    Accepts a multipart PDF upload ('file'), or JSON with 'text' or 'pages' (list of page texts)
+    and an optional 'filename'; optional 'company' / 'ticker' / 'year' (form fields or JSON keys)
+    are stored with the result for lookups. Pass ?store=0 to skip the results store (load tests),
+    ?trace=1 to write a Chrome trace of this request, ?trace=torch to add the torch profiler
+    (torch-profiled requests are served one at a time).
+    ?deadline=SECONDS returns an extrapolated result within the budget (see AnytimeScorer) and
+    keeps refining in the background unless ?refine=0. The budget counts from request arrival,
+    including time spent waiting for memory admission.
+    """
+    started = time.perf_counter()
+    deadline_s = request.args.get('deadline', type=float)
+    trace = request.args.get('trace')
+    trace_dir = (os.environ.get('ESG_TRACE_DIR') or 'traces') if trace else None
+
+    with metrics.document('request') as doc, \
+            tracing.trace_document('request', trace_dir, torch_profile=(trace == 'torch')) as tracer:
+        try:
+            with metrics.timer('extract') as t:
+                filename, texts, page_starts, document_info = read_score_request()
+        except Exception as e:
+            metrics.inc('request_errors', reason='bad_request')
+            doc.failed = True
+            return jsonify({'error': str(e)}), 400
+        doc.filename = filename
+        if tracer is not None:
+            tracer.name = filename
+
+        admission_timeout = None
+        if deadline_s:
+            deadline = started + deadline_s
+            admission_timeout = max(deadline - time.perf_counter(), 0) * ADMISSION_WAIT_SHARE
+        try:
+            with admission(memory_budget, timeout=admission_timeout):
+                if deadline_s:
+                    result = score_document_anytime(texts, filename, page_starts,
+                                                    deadline_s=max(deadline - time.perf_counter(), 0))
+                else:
+                    result = score_document(texts, filename, page_starts)
+        except Exception as e:
+            print(f"❌ Scoring failed for {filename}: {e}")
+            metrics.inc('request_errors', reason='scoring')
+            doc.failed = True
+            return jsonify({'error': str(e), 'filename': filename}), 500
+        result['timings'] = {'extract': t.elapsed, **result['timings']}
+
+    save = request.args.get('store', '1') != '0'
+    response = result_to_response(filename, result)
+    response['metrics'] = doc.summary()
+    if tracer is not None:
+        response['trace_file'] = tracer.path
+        if tracer.torch_path:
+            response['torch_trace_file'] = tracer.torch_path
+    
+    if deadline_s and not result['coverage']['complete']:
+        # Partial result now, the full one lands in the store / job when refinement finishes
+        if request.args.get('refine', '1') != '0':
+            job_id = refine_in_background(filename, result['scorer'], save, document_info)
+            if job_id is None:
+                response['refinement'] = {'status': 'skipped', 'reason': 'refinement queue is full'}
+            else:
+                response['refinement'] = {'job_id': job_id, 'status_url': f'/score/jobs/{job_id}'}
+    elif save:
+        response['document_id'] = store_result(result, **document_info)
+    return jsonify(response)
+
+@app.route('/score/stream', methods=['POST'])
+def score_stream():
+    """
+    Same input as /score, answered as NDJSON (application/x-ndjson) while the document is scored
+    
+    Lines: 'start', then 'sentence' for each ESG sentence (keywords, subcategories, sentiment,
+    confidence, organizations / matched companies, document and page offsets) with a 'totals'
+    line after every batch, and finally 'scores' (or 'error' if scoring fails midway).
+    Pass ?store=0 to skip the results store.
+    """
+    try:
+        with metrics.timer('extract') as t:
+            filename, texts, page_starts, document_info = read_score_request()
+    except Exception as e:
+        metrics.inc('request_errors', reason='bad_request')
+        return jsonify({'error': str(e)}), 400
+    extract_seconds = t.elapsed
+    save = request.args.get('store', '1') != '0'
+
+    def generate():
+        with metrics.document(filename) as doc, admission(memory_budget):
+            try:
+                for event in stream_document(texts, filename, page_starts):
+                    if event['type'] == 'scores':
+                        result = event['result']
+                        result['timings'] = {'extract': extract_seconds, **result['timings']}
+                        event = {'type': 'scores', **result_to_response(filename, result)}
+                        event['metrics'] = doc.summary()
+                        if save:
+                            event['document_id'] = store_result(result, **document_info)
+                    yield json.dumps(event, ensure_ascii=False, default=to_jsonable) + '\n'
+            except Exception as e:
+                print(f"❌ Streaming failed for {filename}: {e}")
+                metrics.inc('request_errors', reason='scoring')
+                doc.failed = True
+                yield json.dumps({'type': 'error', 'error': str(e)}, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/score/jobs/<job_id>', methods=['GET'])
+def refinement_job(job_id):
+    with refinement_lock:
+        job = refinement_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job {job_id}'}), 404
+    return jsonify(job)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='ESG scoring for annual / sustainability reports')
+    parser.add_argument('pdf', nargs='?', default='D:/Jupyter/hackathon_techcombank/esg_report_pdf/AR SAB 2023.pdf')
+    parser.add_argument('--serve', action='store_true', help='Run the scoring service instead of scoring one PDF')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--trace', metavar='DIR', help='Write a Chrome/Perfetto trace of the run to DIR')
+    parser.add_argument('--memory-limit-mb', type=float, help='Adapt batch sizes / pause intake to stay under this RSS')
+    parser.add_argument('--deadline', type=float, metavar='SECONDS',
+                        help='Return an extrapolated score within SECONDS after the models are loaded, then refine')
+    parser.add_argument('--torch-profile', action='store_true', help='Add a torch profiler trace (with --trace)')
+    parser.add_argument('--company', help='Company name stored with the result (results store lookups)')
+    parser.add_argument('--ticker', help='Ticker stored with the result (default: guessed from the file name)')
+    parser.add_argument('--year', type=int, help='Report year stored with the result (default: from the file name)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Print NDJSON sentence evidence / running totals / scores to stdout as they are ready')
+    args = parser.parse_args()
+    document_info = {'company': args.company, 'ticker': args.ticker, 'year': args.year}
+    if args.memory_limit_mb:
+        set_memory_limit(args.memory_limit_mb)
+
+    if args.serve:
+        load_pipeline()
+        app.run(host=args.host, port=args.port, threaded=True)
+    elif args.stream:
+        import sys
+        from contextlib import redirect_stdout
+
+        # stdout carries only NDJSON, progress prints go to stderr
+        out = sys.stdout
+        filename = os.path.basename(args.pdf)
+        with redirect_stdout(sys.stderr), metrics.document(filename) as doc:
+            stored_text, page_starts = pdf_to_document(args.pdf)
+            load_pipeline()
+            for event in stream_document(stored_text, filename, page_starts):
+                if event['type'] == 'scores':
+                    result = event['result']
+                    event = {'type': 'scores', **result_to_response(filename, result)}
+                    event['metrics'] = doc.summary()
+                    event['document_id'] = store_result(result, **document_info)
+                out.write(json.dumps(event, ensure_ascii=False, default=to_jsonable) + '\n')
+                out.flush()
+    else:
+        timings = {}
+
+        with metrics.document(os.path.basename(args.pdf)) as doc, \
+                tracing.trace_document(os.path.basename(args.pdf), args.trace, args.torch_profile):
+            start_time = time.perf_counter()
+            stored_text, page_starts = pdf_to_document(args.pdf)
+            timings['pdf_to_text'] = time.perf_counter() - start_time
+
+            timings['load_models'] = load_pipeline()
+
+            if args.deadline:
+                result = score_document_anytime(stored_text, os.path.basename(args.pdf), page_starts,
+                                                deadline_s=args.deadline)
+            else:
+                result = score_document(stored_text, os.path.basename(args.pdf), page_starts)
+            result['timings'] = {**timings, **result['timings']}
 
-    # this has the output of 20 features
-    df_all_files.to_csv('esg_features_bbc_2023.csv', index=False)
+        print(result['scores']) # This is the return score (E, S, G)
+        print(f"⏱️ Document summary: {doc.summary()}")
 
-    inferred_scores = infer_esg_scores(df_all_files, model_path='d:/Jupyter/hackathon_techcombank/')
+        if args.deadline:
+            print(f"🎯 Coverage: {result['coverage']}")
+            if not result['coverage']['complete']:
+                print("🔄 Refining with the rest of the document...")
+                scorer = result['scorer']
+                timings = result['timings']
+                with metrics.timer('refine') as t:
+                    scorer.run()
+                timings['refine'] = t.elapsed
+                result = score_features(scorer.features(), timings=timings)
+                result['coverage'] = scorer.coverage()
+                print(result['scores'])
 
-    print(inferred_scores) # This is the return score (E, S, G)
+        # this has the output of 20 features
+        result['features'].to_csv('esg_features_bbc_2023.csv', index=False)
 
+        # Keep every run (the CSV above is overwritten), dashboards read from here
+        store_result(result, **document_info)
@@ -0,0 +1,310 @@
+"""
+Per-stage micro-benchmarks for the ESG pipeline
+
+    python benchmark.py --pages 20 50 200 --output benchmark_results.json
+    python benchmark.py --sentiment-model sentiment_regressor_complete.pth --ner-model NlpHUST/ner-vietnamese-electra-base
+    python benchmark.py --baseline benchmark_results_v1.json
+
+Synthetic reports are built from the sentences in sentiment_regression.csv and
+sentiment_data.csv mixed with non-ESG filler. Without --sentiment-model / --ner-model
+small randomly initialised stand-in models are used so the suite runs offline.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+import joblib
+import torch
+
+import app
+from synthetic_reports import load_benchmark_sentences, make_synthetic_pages
+
+PERCENTILES = (50, 90, 95, 99)
+
+def make_synthetic_report(sentences, n_pages, sentences_per_page=30, esg_ratio=0.3, seed=0):
+    """(text, page_starts) in the same shape as app.pdf_to_document"""
+    return app.join_pages(make_synthetic_pages(sentences, n_pages, sentences_per_page, esg_ratio, seed))
+
+# ===== STAND-IN MODELS =====
+def build_standin_models(sentences, workdir):
+    """
+    Tiny randomly initialised models with the same interfaces as the real ones
+
+    Returns:
+        tuple: (model, tokenizer, device, ner_pipeline)
+    """
+    from tokenizers import Tokenizer, models, normalizers, pre_tokenizers, trainers
+    from transformers import (DistilBertConfig, DistilBertModel, DistilBertForTokenClassification,
+                              PreTrainedTokenizerFast, pipeline)
+
+    print("🧪 Building stand-in models...")
+    wordpiece = Tokenizer(models.WordPiece(unk_token='[UNK]'))
+    wordpiece.normalizer = normalizers.BertNormalizer(lowercase=False)
+    wordpiece.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    wordpiece.train_from_iterator(sentences, trainers.WordPieceTrainer(
+        vocab_size=4000, special_tokens=['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+    ))
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=wordpiece, unk_token='[UNK]', pad_token='[PAD]',
+        cls_token='[CLS]', sep_token='[SEP]', mask_token='[MASK]', model_max_length=512
+    )
+
+    model_dir = os.path.join(workdir, 'standin-distilbert')
+    config = DistilBertConfig(vocab_size=tokenizer.vocab_size, dim=64, hidden_dim=256, n_layers=2, n_heads=2)
+    torch.manual_seed(0)
+    DistilBertModel(config).save_pretrained(model_dir)
+    tokenizer.save_pretrained(model_dir)
+
+    device = torch.device('cpu')
+    model = app.FastSentimentRegressor(model_name=model_dir)
+    model.eval()
+
+    ner_config = DistilBertConfig(
+        vocab_size=tokenizer.vocab_size, dim=64, hidden_dim=256, n_layers=2, n_heads=2,
+        id2label={0: 'O', 1: 'B-ORG', 2: 'I-ORG'}, label2id={'O': 0, 'B-ORG': 1, 'I-ORG': 2}
+    )
+    ner_model = DistilBertForTokenClassification(ner_config)
+    ner_model.eval()
+    ner_pipeline = pipeline('ner', model=ner_model, tokenizer=tokenizer, device='cpu', grouped_entities=True)
+    return model, tokenizer, device, ner_pipeline
+
+def build_standin_score_models(train_csv, model_path):
+    """Ridge stand-ins saved under the file names infer_esg_scores expects"""
+    from sklearn.linear_model import Ridge
+    from sklearn.preprocessing import StandardScaler
+
+    df_train = pd.read_csv(train_csv)
+    feature_names = [col for col in df_train.columns if col not in
+                     ['filename', 'esg_tier', 'esg_cluster', 'e_score', 's_score', 'g_score']]
+    X = df_train[feature_names].fillna(0)
+    scaler = StandardScaler().fit(X)
+    for target in ('e_score', 's_score', 'g_score'):
+        joblib.dump(Ridge().fit(scaler.transform(X), df_train[target].fillna(0)),
+                    f'{model_path}xgboost_{target}_model.pkl')
+    joblib.dump(scaler, f'{model_path}xgboost_scaler.pkl')
+    joblib.dump({}, f'{model_path}xgboost_encoders.pkl')
+    joblib.dump(feature_names, f'{model_path}xgboost_features.pkl')
+
+def load_real_models(sentiment_model, ner_model):
+    from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
+
+    model, tokenizer, device = app.load_sentiment_model(sentiment_model)
+    ner_tokenizer = AutoTokenizer.from_pretrained(ner_model)
+    ner_pipeline = pipeline('ner', model=AutoModelForTokenClassification.from_pretrained(ner_model),
+                            tokenizer=ner_tokenizer, device='cpu', grouped_entities=True)
+    return model, tokenizer, device, ner_pipeline
+
+# ===== MEASUREMENT =====
+def summarize(latencies, **units):
+    """
+    Latency percentiles plus throughput for every unit count given
+
+    Args:
+        latencies (list): Seconds per call
+        **units: e.g. sentences=1200, pages=40 -> sentences_per_s, pages_per_s
+    """
+    latencies = np.asarray(latencies, dtype=float)
+    total = float(latencies.sum())
+    result = {
+        'calls': int(latencies.size),
+        'total_s': round(total, 6),
+        'mean_ms': round(float(latencies.mean()) * 1000, 4) if latencies.size else None,
+    }
+    for p in PERCENTILES:
+        result[f'p{p}_ms'] = round(float(np.percentile(latencies, p)) * 1000, 4) if latencies.size else None
+    for name, count in units.items():
+        result[f'{name}_per_s'] = round(count / total, 3) if total > 0 else None
+    return result
+
+def time_calls(fn, items, repeat=1):
+    latencies = []
+    for _ in range(repeat):
+        for item in items:
+            start_time = time.perf_counter()
+            fn(item)
+            latencies.append(time.perf_counter() - start_time)
+    return latencies
+
+def esg_spans(text, spans):
+    """Keyword-positive spans, as selected inside process_esg_files_working"""
+    text_lower = text.lower()
+    return [(start, end) for start, end, _ in spans
+            if end - start >= 10 and app.match_esg_keywords(text_lower, start, end)[0]]
+
+def run_benchmarks(args):
+    sentences = load_benchmark_sentences()
+    if not sentences:
+        raise ValueError("No sentences found in sentiment_regression.csv / sentiment_data.csv")
+
+    workdir = tempfile.mkdtemp(prefix='esg-bench-')
+    if args.sentiment_model and args.ner_model:
+        model, tokenizer, device, ner_pipeline = load_real_models(args.sentiment_model, args.ner_model)
+    else:
+        model, tokenizer, device, ner_pipeline = build_standin_models(sentences, workdir)
+    if model is None:
+        raise RuntimeError("Sentiment model could not be loaded")
+
+    # process_esg_files_working reads these module globals
+    app.model, app.tokenizer, app.device = model, tokenizer, device
+    app.ner_pipeline = ner_pipeline
+    app.company_esg_dict = app.load_company_esg_dict('company_esg.csv')
+
+    score_model_path = args.score_model_path
+    if score_model_path is None:
+        score_model_path = workdir + os.sep
+        build_standin_score_models('esg_features_with_ner_scores.csv', score_model_path)
+    feature_cols, cluster_centroids, scaler = app.load_cluster_reference('esg_features_with_ner_scores.csv')
+
+    rng = random.Random(args.seed)
+    sample = rng.sample(sentences, min(args.sentence_sample, len(sentences)))
+
+    stages = {}
+
+    # Per-sentence model stages
+    app.infer_sentiment(sample[0])  # warm-up
+    stages['infer_sentiment'] = summarize(time_calls(app.infer_sentiment, sample), sentences=len(sample))
+    app.extract_organization_names(sample[0])
+    stages['extract_organization_names'] = summarize(
+        time_calls(app.extract_organization_names, sample), sentences=len(sample)
+    )
+
+    batches = [sample[i:i + app.BATCH_SIZE] for i in range(0, len(sample), app.BATCH_SIZE)]
+    stages['infer_sentiment_batch'] = summarize(time_calls(app.infer_sentiment_batch, batches), sentences=len(sample))
+    stages['extract_organization_names_batch'] = summarize(
+        time_calls(app.extract_organization_names_batch, batches), sentences=len(sample)
+    )
+
+    reports = {}
+    for n_pages in args.pages:
+        text, page_starts = make_synthetic_report(
+            sentences, n_pages, args.sentences_per_page, args.esg_ratio, seed=args.seed + n_pages
+        )
+        spans = app.segment_sentences(text, page_starts)
+        positive = esg_spans(text, spans)
+        text_lower = text.lower()
+        report = {
+            'pages': n_pages,
+            'chars': len(text),
+            'sentences': len(spans),
+            'esg_sentences': len(positive),
+        }
+
+        report['segment_sentences'] = summarize(
+            time_calls(lambda t: app.segment_sentences(t, page_starts), [text], repeat=args.repeat),
+            sentences=len(spans) * args.repeat, pages=n_pages * args.repeat
+        )
+        report['match_esg_keywords'] = summarize(
+            time_calls(lambda span: app.match_esg_keywords(text_lower, span[0], span[1]),
+                       [(s, e) for s, e, _ in spans]),
+            sentences=len(spans)
+        )
+
+        start_time = time.perf_counter()
+        df_features = app.process_esg_files_working(text, f'synthetic_{n_pages}p', page_starts)
+        elapsed = time.perf_counter() - start_time
+        report['process_esg_files_working'] = summarize(
+            [elapsed], sentences=len(spans), esg_sentences=len(positive), pages=n_pages
+        )
+
+        report['assign_cluster'] = summarize(time_calls(
+            lambda df: app.assign_cluster(df, feature_cols, cluster_centroids, scaler),
+            [df_features], repeat=args.repeat
+        ))
+        df_features['esg_cluster'] = app.assign_cluster(df_features, feature_cols, cluster_centroids, scaler)
+        report['infer_esg_scores'] = summarize(time_calls(
+            lambda df: app.infer_esg_scores(df, model_path=score_model_path), [df_features], repeat=args.repeat
+        ))
+        reports[f'{n_pages}p'] = report
+
+    if args.pdf:
+        page_counts = [len(app.read_pdf_pages_with_pdfplumber(path)) for path in args.pdf]
+        stages['pdf_to_text'] = summarize(time_calls(app.pdf_to_text, args.pdf), pages=sum(page_counts))
+
+    return {
+        'metadata': collect_metadata(args, standin=not (args.sentiment_model and args.ner_model)),
+        'stages': stages,
+        'reports': reports,
+    }
+
+def collect_metadata(args, standin):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': commit or None,
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'torch_threads': torch.get_num_threads(),
+        'standin_models': standin,
+        'args': vars(args),
+    }
+
+# ===== REGRESSION CHECK =====
+def flatten_stages(results):
+    """{'stage' or 'report/stage': p50_ms}"""
+    flat = {name: stage['p50_ms'] for name, stage in results.get('stages', {}).items()}
+    for report_name, report in results.get('reports', {}).items():
+        for name, stage in report.items():
+            if isinstance(stage, dict):
+                flat[f'{report_name}/{name}'] = stage['p50_ms']
+    return flat
+
+def compare_results(current, baseline, threshold=0.10):
+    """Print p50 change per stage, returns the stages slower than baseline by more than threshold"""
+    current_flat = flatten_stages(current)
+    baseline_flat = flatten_stages(baseline)
+    regressions = []
+    print(f"\n{'stage':45s} {'baseline p50 ms':>16s} {'current p50 ms':>16s} {'change':>8s}")
+    for name in sorted(set(current_flat) & set(baseline_flat)):
+        before, after = baseline_flat[name], current_flat[name]
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        flag = ' ⚠️' if change > threshold else ''
+        print(f"{name:45s} {before:16.3f} {after:16.3f} {change:+8.1%}{flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-stage micro-benchmarks for the ESG pipeline')
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 50], help='Synthetic report sizes in pages')
+    parser.add_argument('--sentences-per-page', type=int, default=30)
+    parser.add_argument('--esg-ratio', type=float, default=0.3, help='Share of ESG sentences in synthetic reports')
+    parser.add_argument('--sentence-sample', type=int, default=200, help='Sentences for per-sentence model stages')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions for the cheap stages')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--pdf', nargs='*', default=[], help='Real PDFs to time pdf_to_text on')
+    parser.add_argument('--sentiment-model', help='Path to sentiment_regressor_complete.pth (default: stand-in)')
+    parser.add_argument('--ner-model', help='NER model name or path (default: stand-in)')
+    parser.add_argument('--score-model-path', help='Directory prefix of the xgboost_*.pkl files (default: stand-in)')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='Earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='p50 slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"💾 Benchmark results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_results(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} stage(s) slower than baseline: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
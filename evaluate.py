@@ -0,0 +1,392 @@
+"""
+Speed / accuracy evaluation of an optimized inference configuration against the reference pipeline
+
+    python evaluate.py --config batched
+    python evaluate.py --config quantized --reports-dir reports/ --labels overall_esg_scores.csv article_esg.csv
+    python evaluate.py --config anytime --deadline 5 --max-flip-rate 0.02 --max-score-drift 1.0
+
+The reference is the original pipeline: one infer_sentiment / extract_organization_names
+call per sentence. Sentence level runs over sentiment_regression.csv (gold scores). Document
+level runs over the reports named in the label CSVs, looked up in --reports-dir as <name>,
+<name>.pdf or <name>.txt. Without any of them, synthetic reports are used and only drift
+against the reference is reported. Without --sentiment-model / --ner-model the stand-in
+models from benchmark.py are used, so only speed and drift mean something.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import torch
+
+import app
+from benchmark import (build_standin_models, build_standin_score_models, load_real_models,
+                       make_synthetic_report, collect_metadata)
+from synthetic_reports import load_benchmark_sentences
+
+SCORE_COLUMNS = ['e_score', 's_score', 'g_score']
+FLIP_THRESHOLDS = (app.NEGATIVE_THRESHOLD, app.POSITIVE_THRESHOLD)
+
+# Named configurations; --batch-size / --quantize / --deadline override the chosen one
+CONFIGS = {
+    'reference': {'batch_size': 1, 'reference': True},
+    'batched': {'batch_size': app.BATCH_SIZE},
+    'quantized': {'batch_size': app.BATCH_SIZE, 'quantize': True},
+    'anytime': {'batch_size': app.BATCH_SIZE, 'deadline_s': 5.0},
+}
+
+# ===== CONFIGURATIONS =====
+def quantize(model):
+    """int8 dynamic quantization of the Linear layers (CPU)"""
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+@contextmanager
+def use_config(config):
+    """Apply a configuration to the app module globals for the duration of the block"""
+    saved = (app.model, app.ner_pipeline.model, app.infer_sentiment_batch, app.extract_organization_names_batch,
+             app.sentiment_batcher.batch_size, app.ner_batcher.batch_size)
+    try:
+        app.sentiment_batcher.batch_size = app.ner_batcher.batch_size = config['batch_size']
+        if config.get('reference'):
+            app.infer_sentiment_batch = lambda sentences: [app.infer_sentiment(s) for s in sentences]
+            app.extract_organization_names_batch = lambda texts: [app.extract_organization_names(t) for t in texts]
+        if config.get('quantize'):
+            app.model = quantize(app.model)
+            app.ner_pipeline.model = quantize(app.ner_pipeline.model)
+        yield
+    finally:
+        (app.model, app.ner_pipeline.model, app.infer_sentiment_batch, app.extract_organization_names_batch,
+         app.sentiment_batcher.batch_size, app.ner_batcher.batch_size) = saved
+
+# ===== COMPARISON =====
+def compare_sentence_scores(reference, optimized, gold=None):
+    """MAE / flip rates of optimized vs reference sentence scores (and both vs gold when given)"""
+    reference, optimized = np.asarray(reference, dtype=float), np.asarray(optimized, dtype=float)
+    if len(reference) == 0:
+        return {'sentences': 0}
+    ref_labels = [app.sentiment_label(score) for score in reference]
+    opt_labels = [app.sentiment_label(score) for score in optimized]
+    result = {
+        'sentences': len(reference),
+        'mae_vs_reference': float(np.mean(np.abs(optimized - reference))),
+        'max_abs_diff': float(np.max(np.abs(optimized - reference))),
+        'label_flip_rate': float(np.mean([r != o for r, o in zip(ref_labels, opt_labels)])),
+    }
+    for threshold in FLIP_THRESHOLDS:
+        result[f'flip_rate_{threshold}'] = float(np.mean((reference >= threshold) != (optimized >= threshold)))
+
+    if gold is not None:
+        gold = np.asarray(gold, dtype=float)
+        gold_labels = [app.sentiment_label(score) for score in gold]
+        result.update({
+            'mae_vs_gold_reference': float(np.mean(np.abs(reference - gold))),
+            'mae_vs_gold_optimized': float(np.mean(np.abs(optimized - gold))),
+            'label_accuracy_reference': float(np.mean([r == g for r, g in zip(ref_labels, gold_labels)])),
+            'label_accuracy_optimized': float(np.mean([o == g for o, g in zip(opt_labels, gold_labels)])),
+        })
+    return result
+
+def feature_drift(reference, optimized):
+    """How far the pos_* / neg_* counts moved"""
+    columns = [col for col in reference if col.startswith(('pos_', 'neg_'))]
+    diffs = {col: abs(optimized[col] - reference[col]) for col in columns}
+    total = sum(reference[col] for col in columns)
+    return {
+        'count_abs_diff': float(sum(diffs.values())),
+        'count_rel_diff': float(sum(diffs.values()) / max(total, 1)),
+        'features_changed': sum(1 for diff in diffs.values() if diff > 1e-9),
+    }
+
+# ===== SENTENCE LEVEL =====
+def load_labeled_sentences(path='sentiment_regression.csv'):
+    """(sentences, gold scores); rows without text or with a non-numeric score are skipped"""
+    df = pd.read_csv(path)
+    total = len(df)
+    df['score'] = pd.to_numeric(df['score'], errors='coerce')
+    df = df.dropna(subset=['sentence', 'score'])
+    df = df[df['sentence'].astype(str).str.strip().astype(bool)]
+    if len(df) < total:
+        print(f"⚠️ Skipped {total - len(df)} row(s) of {path} without a sentence or numeric score")
+    return df['sentence'].astype(str).tolist(), df['score'].astype(float).tolist()
+
+def score_sentences(sentences, config):
+    """(scores, seconds) with the configuration's sentiment path and batch size"""
+    with use_config(config):
+        app.infer_sentiment_batch(sentences[:1])  # warm-up
+        batch_size = config['batch_size']
+        start_time = time.perf_counter()
+        scores = []
+        for i in range(0, len(sentences), batch_size):
+            scores.extend(app.infer_sentiment_batch(sentences[i:i + batch_size]))
+        return scores, time.perf_counter() - start_time
+
+def evaluate_sentences(sentences, gold, reference_config, config):
+    reference, reference_seconds = score_sentences(sentences, reference_config)
+    optimized, optimized_seconds = score_sentences(sentences, config)
+    result = compare_sentence_scores(reference, optimized, gold)
+    result.update({
+        'reference_seconds': round(reference_seconds, 4),
+        'optimized_seconds': round(optimized_seconds, 4),
+        'speedup': round(reference_seconds / max(optimized_seconds, 1e-9), 3),
+    })
+    return result
+
+# ===== DOCUMENT LEVEL =====
+def resolve_report(reports_dir, name):
+    """Path of the report file for a label row, None when it is not there"""
+    name = str(name).strip()
+    for candidate in (name, f'{name}.pdf', f'{name}.txt'):
+        path = os.path.join(reports_dir, candidate)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def read_report(path):
+    """(texts, page_starts) for a .pdf or plain-text report"""
+    if path.lower().endswith('.pdf'):
+        return app.pdf_to_document(path)
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return f.read(), None
+
+def load_labeled_documents(reports_dir, label_paths):
+    """[{'name', 'texts', 'page_starts', 'gold'}] for every labeled report found in reports_dir"""
+    documents, missing = {}, []
+    for label_path in label_paths:
+        labels = pd.read_csv(label_path, skipinitialspace=True).dropna(subset=SCORE_COLUMNS)
+        for row in labels.to_dict('records'):
+            name = str(row['filename']).strip()
+            if name in documents:
+                continue
+            path = resolve_report(reports_dir, name)
+            if path is None:
+                missing.append(name)
+                continue
+            texts, page_starts = read_report(path)
+            documents[name] = {'name': name, 'texts': texts, 'page_starts': page_starts,
+                               'gold': {col: float(row[col]) for col in SCORE_COLUMNS}}
+    if missing:
+        print(f"⚠️ {len(missing)} labeled report(s) not found in {reports_dir}: {', '.join(missing[:10])}")
+    return list(documents.values())
+
+def run_document(document, config, esg_model_path):
+    """Features, E/S/G scores, per-sentence sentiment scores and seconds for one configuration"""
+    with use_config(config):
+        start_time = time.perf_counter()
+        if config.get('deadline_s'):
+            result = app.score_document_anytime(document['texts'], document['name'], document['page_starts'],
+                                                deadline_s=config['deadline_s'], esg_model_path=esg_model_path)
+            sentence_scores = {record['sentence_id']: record['sentiment_score'] for record in result['scorer'].records}
+            coverage = result['coverage']
+        else:
+            sentence_scores = {}
+            for event in app.stream_document(document['texts'], document['name'], document['page_starts'],
+                                             esg_model_path=esg_model_path):
+                if event['type'] == 'sentence':
+                    sentence_scores[event['sentence_id']] = event['sentiment_score']
+                elif event['type'] == 'scores':
+                    result = event['result']
+            coverage = None
+        seconds = time.perf_counter() - start_time
+
+    scores = result['scores']
+    return {
+        'features': result['features'].iloc[0].to_dict(),
+        'scores': {col: float(scores.iloc[0][col]) for col in SCORE_COLUMNS} if scores is not None else None,
+        'sentence_scores': sentence_scores,
+        'coverage': coverage,
+        'seconds': seconds,
+    }
+
+def evaluate_documents(documents, reference_config, config, esg_model_path):
+    per_document = []
+    reference_sentences, optimized_sentences = [], []
+    for document in documents:
+        print(f"📄 {document['name']}...")
+        reference = run_document(document, reference_config, esg_model_path)
+        optimized = run_document(document, config, esg_model_path)
+
+        common = sorted(set(reference['sentence_scores']) & set(optimized['sentence_scores']))
+        reference_sentences.extend(reference['sentence_scores'][i] for i in common)
+        optimized_sentences.extend(optimized['sentence_scores'][i] for i in common)
+
+        entry = {
+            'name': document['name'],
+            'esg_sentences': len(reference['sentence_scores']),
+            'reference_seconds': round(reference['seconds'], 4),
+            'optimized_seconds': round(optimized['seconds'], 4),
+            'feature_drift': feature_drift(reference['features'], optimized['features']),
+            'score_drift': None,
+            'reference_scores': reference['scores'],
+            'optimized_scores': optimized['scores'],
+            'gold': document.get('gold'),
+        }
+        if reference['scores'] is not None and optimized['scores'] is not None:
+            entry['score_drift'] = {col: optimized['scores'][col] - reference['scores'][col] for col in SCORE_COLUMNS}
+        if optimized['coverage'] is not None:
+            entry['coverage'] = optimized['coverage']['coverage']
+        per_document.append(entry)
+
+    return {
+        'summary': summarize_documents(per_document, reference_sentences, optimized_sentences),
+        'documents': per_document,
+    }
+
+def summarize_documents(per_document, reference_sentences, optimized_sentences):
+    reference_seconds = sum(doc['reference_seconds'] for doc in per_document)
+    optimized_seconds = sum(doc['optimized_seconds'] for doc in per_document)
+    summary = {
+        'documents': len(per_document),
+        'reference_seconds': round(reference_seconds, 4),
+        'optimized_seconds': round(optimized_seconds, 4),
+        'speedup': round(reference_seconds / max(optimized_seconds, 1e-9), 3),
+        'sentences': compare_sentence_scores(reference_sentences, optimized_sentences),
+        'feature_count_rel_diff': float(np.mean([doc['feature_drift']['count_rel_diff'] for doc in per_document]))
+        if per_document else None,
+    }
+
+    scored = [doc for doc in per_document if doc['score_drift'] is not None]
+    for col in SCORE_COLUMNS:
+        drifts = [abs(doc['score_drift'][col]) for doc in scored]
+        summary[f'{col}_drift_mae'] = float(np.mean(drifts)) if drifts else None
+        summary[f'{col}_drift_max'] = float(np.max(drifts)) if drifts else None
+
+        labeled = [doc for doc in scored if doc['gold'] is not None]
+        if labeled:
+            summary[f'{col}_mae_vs_gold_reference'] = float(np.mean(
+                [abs(doc['reference_scores'][col] - doc['gold'][col]) for doc in labeled]))
+            summary[f'{col}_mae_vs_gold_optimized'] = float(np.mean(
+                [abs(doc['optimized_scores'][col] - doc['gold'][col]) for doc in labeled]))
+    return summary
+
+# ===== SETUP / REPORTING =====
+def setup_models(args, sentences, workdir):
+    """Load (or build stand-in) models into the app module globals, returns the ESG score model path"""
+    if args.sentiment_model and args.ner_model:
+        model, tokenizer, device, ner_pipeline = load_real_models(args.sentiment_model, args.ner_model)
+    else:
+        model, tokenizer, device, ner_pipeline = build_standin_models(sentences, workdir)
+    if model is None:
+        raise RuntimeError("Sentiment model could not be loaded")
+
+    app.model, app.tokenizer, app.device = model, tokenizer, device
+    app.ner_pipeline = ner_pipeline
+    app.company_esg_dict = app.load_company_esg_dict('company_esg.csv')
+    app.cluster_reference = app.load_cluster_reference('esg_features_with_ner_scores.csv')
+
+    score_model_path = args.score_model_path
+    if score_model_path is None:
+        score_model_path = workdir + os.sep
+        build_standin_score_models('esg_features_with_ner_scores.csv', score_model_path)
+    return score_model_path
+
+def build_config(args):
+    config = dict(CONFIGS[args.config])
+    if args.batch_size is not None:
+        config['batch_size'] = args.batch_size
+    if args.quantize:
+        config['quantize'] = True
+    if args.deadline is not None:
+        config['deadline_s'] = args.deadline
+    return config
+
+def print_report(results):
+    sentence = results['sentence_level']
+    print(f"\n📊 Sentence level ({sentence['sentences']} sentences): speedup x{sentence['speedup']}, "
+          f"MAE vs reference {sentence['mae_vs_reference']:.4f}, label flips {sentence['label_flip_rate']:.2%}, "
+          + ', '.join(f"flips@{t} {sentence[f'flip_rate_{t}']:.2%}" for t in FLIP_THRESHOLDS))
+    print(f"   MAE vs gold: reference {sentence['mae_vs_gold_reference']:.4f}, "
+          f"optimized {sentence['mae_vs_gold_optimized']:.4f}")
+
+    document = results['document_level']['summary']
+    if not document['documents']:
+        return
+    print(f"📊 Document level ({document['documents']} documents): speedup x{document['speedup']}, "
+          f"pos/neg count drift {document['feature_count_rel_diff']:.2%}, "
+          f"ESG-sentence label flips {document['sentences'].get('label_flip_rate', 0):.2%}")
+    for col in SCORE_COLUMNS:
+        line = f"   {col}: drift MAE {document[f'{col}_drift_mae']}, max {document[f'{col}_drift_max']}"
+        if f'{col}_mae_vs_gold_reference' in document:
+            line += (f", MAE vs gold reference {document[f'{col}_mae_vs_gold_reference']:.3f}"
+                     f" / optimized {document[f'{col}_mae_vs_gold_optimized']:.3f}")
+        print(line)
+
+def check_gates(results, max_flip_rate=None, max_score_drift=None):
+    """Names of the accuracy gates the optimized configuration fails"""
+    failures = []
+    sentence = results['sentence_level']
+    document = results['document_level']['summary']
+    if max_flip_rate is not None:
+        if sentence['label_flip_rate'] > max_flip_rate:
+            failures.append('sentence_label_flip_rate')
+        if document['sentences'].get('label_flip_rate', 0) > max_flip_rate:
+            failures.append('document_label_flip_rate')
+    if max_score_drift is not None:
+        for col in SCORE_COLUMNS:
+            if (document.get(f'{col}_drift_max') or 0) > max_score_drift:
+                failures.append(f'{col}_drift')
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Speed / accuracy of an optimized configuration vs the reference pipeline')
+    parser.add_argument('--config', choices=sorted(CONFIGS), default='batched')
+    parser.add_argument('--batch-size', type=int, help='Override the configuration batch size')
+    parser.add_argument('--quantize', action='store_true', help='int8 dynamic quantization of both models')
+    parser.add_argument('--deadline', type=float, metavar='SECONDS', help='Anytime scoring per document')
+    parser.add_argument('--sentences', default='sentiment_regression.csv', help='Labeled sentence scores')
+    parser.add_argument('--sentence-sample', type=int, help='Only the first N labeled sentences')
+    parser.add_argument('--reports-dir', help='Directory with the reports named in the label CSVs')
+    parser.add_argument('--labels', nargs='+', default=['overall_esg_scores.csv', 'article_esg.csv'])
+    parser.add_argument('--synthetic-pages', type=int, nargs='*', default=[10, 30],
+                        help='Synthetic report sizes used when no labeled report is found')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--sentiment-model', help='Path to sentiment_regressor_complete.pth (default: stand-in)')
+    parser.add_argument('--ner-model', help='NER model name or path (default: stand-in)')
+    parser.add_argument('--score-model-path', help='Directory prefix of the xgboost_*.pkl files (default: stand-in)')
+    parser.add_argument('--output', help='Results JSON (default: evaluation_<config>.json)')
+    parser.add_argument('--max-flip-rate', type=float, help='Fail when the label flip rate is above this')
+    parser.add_argument('--max-score-drift', type=float, help='Fail when any E/S/G score moves more than this')
+    args = parser.parse_args(argv)
+
+    sentences, gold = load_labeled_sentences(args.sentences)
+    if args.sentence_sample:
+        sentences, gold = sentences[:args.sentence_sample], gold[:args.sentence_sample]
+
+    workdir = tempfile.mkdtemp(prefix='esg-eval-')
+    esg_model_path = setup_models(args, load_benchmark_sentences(), workdir)
+    reference_config, config = CONFIGS['reference'], build_config(args)
+    print(f"⚖️ Evaluating {config} against {reference_config}")
+
+    documents = load_labeled_documents(args.reports_dir, args.labels) if args.reports_dir else []
+    if not documents:
+        print("⚠️ No labeled reports, using synthetic reports (drift only)")
+        benchmark_sentences = load_benchmark_sentences()
+        documents = []
+        for n_pages in args.synthetic_pages:
+            texts, page_starts = make_synthetic_report(benchmark_sentences, n_pages, seed=args.seed + n_pages)
+            documents.append({'name': f'synthetic_{n_pages}p', 'texts': texts, 'page_starts': page_starts, 'gold': None})
+
+    results = {
+        'metadata': collect_metadata(args, standin=not (args.sentiment_model and args.ner_model)),
+        'config': config,
+        'sentence_level': evaluate_sentences(sentences, gold, reference_config, config),
+        'document_level': evaluate_documents(documents, reference_config, config, esg_model_path),
+    }
+    print_report(results)
+
+    output = args.output or f'evaluation_{args.config}.json'
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False, default=app.to_jsonable)
+    print(f"💾 Evaluation results saved to {output}")
+
+    failures = check_gates(results, args.max_flip_rate, args.max_score_drift)
+    if failures:
+        print(f"❌ Accuracy gates failed: {', '.join(failures)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""
+Load generator for the scoring service (python app.py --serve)
+
+    python load_test.py --url http://127.0.0.1:5000 --concurrency 1 2 4 8 --requests 40 --label threads4
+    python load_test.py --report capacity_threads4.json capacity_threads8.json
+
+Fires concurrent POST /score requests with a mix of synthetic document sizes, sweeps
+concurrency levels and records throughput, p50/p95/p99 latency, error rate and the
+worker's CPU / RSS. Standard library only (psutil is used when installed).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from synthetic_reports import load_benchmark_sentences, make_synthetic_pages
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+# ===== WORKER MONITOR =====
+def read_process_stats(pid):
+    """(cpu_seconds, rss_bytes) of a local process, or None when it cannot be read"""
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            cpu = process.cpu_times()
+            return cpu.user + cpu.system, process.memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        with open(f'/proc/{pid}/statm') as f:
+            rss_bytes = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        return cpu_seconds, rss_bytes
+    except (OSError, IndexError, ValueError):
+        return None
+
+class WorkerMonitor:
+    """Samples a worker's CPU % and RSS in a background thread while a level runs"""
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_percent = []
+        self.rss_bytes = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        previous = read_process_stats(self.pid)
+        previous_time = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            current = read_process_stats(self.pid)
+            now = time.perf_counter()
+            if current is None or previous is None:
+                previous, previous_time = current, now
+                continue
+            self.cpu_percent.append(100 * (current[0] - previous[0]) / (now - previous_time))
+            self.rss_bytes.append(current[1])
+            previous, previous_time = current, now
+
+    def __enter__(self):
+        if self.pid is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def summary(self):
+        if not self.rss_bytes:
+            return {'cpu_percent_mean': None, 'cpu_percent_max': None, 'rss_mb_max': None}
+        return {
+            'cpu_percent_mean': round(sum(self.cpu_percent) / len(self.cpu_percent), 1),
+            'cpu_percent_max': round(max(self.cpu_percent), 1),
+            'rss_mb_max': round(max(self.rss_bytes) / 2**20, 1),
+        }
+
+# ===== LOAD GENERATION =====
+def parse_mix(mix):
+    """['5:0.5', '50:0.3', '200:0.2'] -> [(5, 0.5), (50, 0.3), (200, 0.2)]"""
+    parsed = []
+    for item in mix:
+        pages, _, weight = item.partition(':')
+        parsed.append((int(pages), float(weight or 1)))
+    return parsed
+
+def build_documents(mix, n_variants, seed):
+    """A few synthetic documents per size so identical bodies are not re-sent every time"""
+    sentences = load_benchmark_sentences()
+    documents = {}
+    for pages, _ in mix:
+        documents[pages] = [
+            json.dumps({
+                'filename': f'loadtest_{pages}p_{variant}',
+                'pages': make_synthetic_pages(sentences, pages, seed=seed + 1000 * pages + variant),
+            }).encode('utf-8')
+            for variant in range(n_variants)
+        ]
+    return documents
+
+def post_score(url, body, timeout):
+    """Returns (latency_s, ok, error)"""
+    request = urllib.request.Request(
+        f'{url}/score?store=0', data=body, headers={'Content-Type': 'application/json'}, method='POST'
+    )
+    start_time = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            ok, error = response.status == 200, None if response.status == 200 else f'HTTP {response.status}'
+    except urllib.error.HTTPError as e:
+        ok, error = False, f'HTTP {e.code}'
+    except Exception as e:
+        ok, error = False, type(e).__name__
+    return time.perf_counter() - start_time, ok, error
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+def run_level(url, concurrency, n_requests, mix, documents, timeout, pid, seed):
+    """Closed loop: `concurrency` clients send back-to-back requests until n_requests are done"""
+    rng = random.Random(seed + concurrency)
+    sizes = [pages for pages, _ in mix]
+    weights = [weight for _, weight in mix]
+    plan = []
+    for _ in range(n_requests):
+        pages = rng.choices(sizes, weights)[0]
+        plan.append((pages, rng.choice(documents[pages])))
+
+    with WorkerMonitor(pid) as monitor, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start_time = time.perf_counter()
+        results = list(pool.map(lambda item: (item[0],) + post_score(url, item[1], timeout), plan))
+        duration = time.perf_counter() - start_time
+
+    latencies = [latency for _, latency, ok, _ in results if ok]
+    errors = [error for _, _, ok, error in results if not ok]
+    pages_done = sum(pages for pages, _, ok, _ in results if ok)
+    level = {
+        'concurrency': concurrency,
+        'requests': n_requests,
+        'errors': len(errors),
+        'error_rate': round(len(errors) / n_requests, 4),
+        'error_types': {e: errors.count(e) for e in set(errors)},
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(latencies) / duration, 3),
+        'pages_per_s': round(pages_done / duration, 2),
+    }
+    for p in (50, 95, 99):
+        value = percentile(latencies, p)
+        level[f'p{p}_ms'] = round(value * 1000, 1) if value is not None else None
+    level.update(monitor.summary())
+    return level
+
+def find_worker_pid(url, timeout):
+    """Ask /health for the worker pid; only meaningful when the service runs on this machine"""
+    if urlparse(url).hostname not in ('127.0.0.1', 'localhost', '::1'):
+        return None
+    try:
+        with urllib.request.urlopen(f'{url}/health', timeout=timeout) as response:
+            return json.loads(response.read()).get('pid')
+    except Exception as e:
+        print(f"⚠️ Could not reach {url}/health: {e}")
+        return None
+
+# ===== REPORTING =====
+COLUMNS = ['concurrency', 'throughput_rps', 'pages_per_s', 'p50_ms', 'p95_ms', 'p99_ms',
+           'error_rate', 'cpu_percent_mean', 'rss_mb_max']
+
+def print_curve(result):
+    print(f"\n📈 Capacity curve: {result['label']}")
+    print(' '.join(f'{c:>16s}' for c in COLUMNS))
+    for level in result['levels']:
+        print(' '.join(f"{'-' if level.get(c) is None else level[c]:>16}" for c in COLUMNS))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the ESG scoring service')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--requests', type=int, default=40, help='Requests per concurrency level')
+    parser.add_argument('--mix', nargs='+', default=['5:0.5', '50:0.3', '200:0.2'],
+                        help='Document sizes as pages:weight')
+    parser.add_argument('--variants', type=int, default=3, help='Distinct documents per size')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--pid', type=int, help='Worker pid to monitor (default: from /health)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--label', default='default', help='Configuration name, e.g. threads4-batch16')
+    parser.add_argument('--output', help='Capacity curve JSON (default: capacity_<label>.json)')
+    parser.add_argument('--report', nargs='+', help='Only print the curves stored in these JSON files')
+    args = parser.parse_args(argv)
+
+    if args.report:
+        for path in args.report:
+            with open(path, encoding='utf-8') as f:
+                print_curve(json.load(f))
+        return 0
+
+    url = args.url.rstrip('/')
+    mix = parse_mix(args.mix)
+    pid = args.pid or find_worker_pid(url, timeout=10)
+    documents = build_documents(mix, args.variants, args.seed)
+
+    levels = []
+    for concurrency in args.concurrency:
+        print(f"🚀 concurrency={concurrency}, {args.requests} requests...")
+        levels.append(run_level(url, concurrency, args.requests, mix, documents, args.timeout, pid, args.seed))
+
+    result = {
+        'label': args.label,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'url': url,
+        'mix': args.mix,
+        'worker_pid': pid,
+        'levels': levels,
+    }
+    print_curve(result)
+
+    output = args.output or f'capacity_{args.label}.json'
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f"💾 Capacity curve saved to {output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
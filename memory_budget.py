@@ -0,0 +1,151 @@
+import os
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+import metrics
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# ===== MEMORY BUDGET =====
+# Opt-in with ESG_MEMORY_LIMIT_MB (or --memory-limit-mb). Batch sizes for the
+# sentiment / NER calls shrink when RSS + the estimated activation size of the next
+# batch gets close to the limit and grow back when there is headroom; new documents
+# wait at admission while RSS is above the high-water mark.
+
+MB = 2 ** 20
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def current_rss():
+    """Resident set size of this process in bytes (0 if it cannot be read)"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        import resource
+        # Peak, not current, but the best we have without /proc (kB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if peak > 2 ** 32 else peak * 1024
+    except ImportError:
+        return 0
+
+def estimate_activation_bytes(batch_size, seq_len, config, dtype_bytes=4):
+    """
+    Rough peak activation size of one no-grad forward pass of a BERT-style encoder
+
+    Per layer: hidden states, Q/K/V/output projections and the 4x FFN intermediate
+    (~8 * hidden per token) plus the attention score matrices (heads * seq_len per token).
+    Without autograd only about two layers are alive at once.
+    """
+    hidden = getattr(config, 'hidden_size', None) or getattr(config, 'dim', 768)
+    heads = getattr(config, 'num_attention_heads', None) or getattr(config, 'n_heads', 12)
+    per_layer = batch_size * seq_len * (8 * hidden + 2 * heads * seq_len) * dtype_bytes
+    return 2 * per_layer
+
+class MemoryBudget:
+    """
+    Process-wide memory limit
+
+    Args:
+        limit_bytes (int): Target ceiling for RSS
+        high_water (float): Fraction of the limit where batches shrink and intake pauses
+        low_water (float): Fraction of the limit below which batches may grow again
+    """
+    def __init__(self, limit_bytes, high_water=0.85, low_water=0.6):
+        self.limit_bytes = limit_bytes
+        self.high_water = high_water
+        self.low_water = low_water
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls):
+        limit_mb = os.environ.get('ESG_MEMORY_LIMIT_MB')
+        return cls(int(float(limit_mb) * MB)) if limit_mb else None
+
+    def over_high_water(self, extra_bytes=0):
+        return current_rss() + extra_bytes > self.limit_bytes * self.high_water
+
+    def under_low_water(self, extra_bytes=0):
+        return current_rss() + extra_bytes < self.limit_bytes * self.low_water
+
+    @contextmanager
+    def admit(self, poll_seconds=0.5, timeout=None):
+        """
+        Hold a new document back while RSS is above the high-water mark (never blocks the only document)
+        
+        Args:
+            timeout (float): Admit anyway after waiting this long (deadline requests), None waits as long as needed
+        """
+        give_up_at = None if timeout is None else time.perf_counter() + timeout
+        with self.condition:
+            waited = False
+            while self.in_flight > 0 and self.over_high_water():
+                if give_up_at is not None and time.perf_counter() >= give_up_at:
+                    metrics.inc('admission_timeouts')
+                    break
+                if not waited:
+                    print(f"⏸️ Memory near limit ({current_rss() / MB:.0f} MB), pausing intake")
+                    metrics.inc('intake_paused')
+                    waited = True
+                wait = poll_seconds if give_up_at is None else min(poll_seconds, max(give_up_at - time.perf_counter(), 0))
+                self.condition.wait(wait)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+class AdaptiveBatcher:
+    """
+    Batch size for one model; fixed without a budget, adaptive with one
+
+    Args:
+        name (str): Model name used in metrics ('sentiment', 'ner')
+        initial (int): Starting batch size
+        max_size (int): Upper bound when growing
+        seq_len (int): Padded sequence length used for the activation estimate
+        budget (MemoryBudget): None for a fixed batch size
+    """
+    def __init__(self, name, initial=16, max_size=64, seq_len=128, budget=None):
+        self.name = name
+        self.batch_size = initial
+        self.max_size = max_size
+        self.seq_len = seq_len
+        self.budget = budget
+        self.config = None
+        self.lock = threading.Lock()
+
+    def next_batch_size(self):
+        """Batch size to use for the next call; also records RSS for the per-document peak"""
+        rss = current_rss()
+        metrics.observe_peak('rss_bytes', rss)
+        if self.budget is None or self.config is None:
+            return self.batch_size
+
+        with self.lock:
+            size = self.batch_size
+            while size > 1 and self.budget.over_high_water(
+                    estimate_activation_bytes(size, self.seq_len, self.config)):
+                size //= 2
+            if size == self.batch_size and size < self.max_size and self.budget.under_low_water(
+                    estimate_activation_bytes(size * 2, self.seq_len, self.config)):
+                size *= 2
+            if size != self.batch_size:
+                metrics.inc('batch_resizes', model=self.name, direction='down' if size < self.batch_size else 'up')
+                self.batch_size = size
+            metrics.set_gauge('batch_size_current', size, model=self.name)
+            return size
+
+def admission(budget, timeout=None):
+    """budget.admit(timeout=timeout) or a no-op when no memory budget is configured"""
+    return budget.admit(timeout=timeout) if budget is not None else nullcontext()
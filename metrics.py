@@ -0,0 +1,229 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import tracing
+
+# ===== HOT-PATH METRICS =====
+# Process-wide counters / stage timers / batch-size histograms, rendered in the
+# Prometheus text format for GET /metrics. Everything recorded while a
+# `document(...)` block is active is also added to that document's summary.
+
+PREFIX = 'esg_'
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+_lock = threading.Lock()
+_counters = {}     # (name, labels) -> value
+_gauges = {}       # (name, labels) -> value
+_timers = {}       # (stage, labels) -> [sum_seconds, count]
+_histograms = {}   # (name, labels) -> [bucket_counts, sum, count]
+
+_current_document = contextvars.ContextVar('esg_current_document', default=None)
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def _label_suffix(labels):
+    return '.'.join(str(v) for _, v in sorted(labels.items()))
+
+class DocumentMetrics:
+    """Counters and stage timings for one document"""
+    def __init__(self, filename):
+        self.filename = filename
+        self.started = time.perf_counter()
+        self.finished = None
+        self.counters = {}
+        self.stages = {}
+        self.batch_sizes = {}
+        self.peaks = {}
+        self.failed = False   # set by the caller for handled failures (bad request, scoring error)
+
+    def _add_counter(self, name, labels, value):
+        key = f'{name}.{_label_suffix(labels)}' if labels else name
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def _add_stage(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def _add_batch(self, name, labels, size):
+        key = _label_suffix(labels) or name
+        self.batch_sizes.setdefault(key, []).append(size)
+
+    def _add_peak(self, name, value):
+        self.peaks[name] = max(self.peaks.get(name, value), value)
+
+    def summary(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return {
+            'filename': self.filename,
+            'total_seconds': round(end - self.started, 6),
+            'stages': {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            'counters': dict(self.counters),
+            'batch_sizes': {
+                key: {'batches': len(sizes), 'mean': round(sum(sizes) / len(sizes), 2), 'max': max(sizes)}
+                for key, sizes in self.batch_sizes.items()
+            },
+            'peaks': dict(self.peaks),
+        }
+
+def inc(name, value=1, **labels):
+    """Increment a counter, e.g. inc('transformer_calls', model='sentiment')"""
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+    doc = _current_document.get()
+    if doc is not None:
+        doc._add_counter(name, labels, value)
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def add_gauge(name, value, **labels):
+    with _lock:
+        key = _key(name, labels)
+        _gauges[key] = _gauges.get(key, 0) + value
+
+def observe_peak(name, value):
+    """Keep the maximum seen, e.g. observe_peak('rss_bytes', rss) -> esg_rss_bytes_peak"""
+    with _lock:
+        key = _key(f'{name}_peak', {})
+        _gauges[key] = max(_gauges.get(key, value), value)
+    doc = _current_document.get()
+    if doc is not None:
+        doc._add_peak(name, value)
+
+def observe_batch(size, name='batch_size', **labels):
+    """Record the size of one batched model call"""
+    with _lock:
+        key = _key(name, labels)
+        if key not in _histograms:
+            _histograms[key] = [[0] * len(BATCH_SIZE_BUCKETS), 0, 0]
+        entry = _histograms[key]
+        buckets = entry[0]
+        for i, bound in enumerate(BATCH_SIZE_BUCKETS):
+            if size <= bound:
+                buckets[i] += 1
+        entry[1] += size
+        entry[2] += 1
+    doc = _current_document.get()
+    if doc is not None:
+        doc._add_batch(name, labels, size)
+
+def record_stage(stage, seconds, **labels):
+    with _lock:
+        key = _key(stage, labels)
+        entry = _timers.setdefault(key, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    doc = _current_document.get()
+    if doc is not None:
+        doc._add_stage(stage, seconds)
+
+class _Timer:
+    elapsed = 0.0
+
+@contextmanager
+def timer(stage, **labels):
+    """
+    Time a pipeline stage (also a tracing span when the document is traced)
+
+        with metrics.timer('assign_cluster') as t:
+            ...
+        timings['assign_cluster'] = t.elapsed
+    """
+    result = _Timer()
+    start_time = time.perf_counter()
+    try:
+        with tracing.span(stage, **labels):
+            yield result
+    finally:
+        result.elapsed = time.perf_counter() - start_time
+        record_stage(stage, result.elapsed, **labels)
+
+@contextmanager
+def document(filename):
+    """
+    Collect a per-document summary for everything recorded inside the block
+
+    documents_scored only counts blocks that end without an exception and without doc.failed set
+    """
+    doc = DocumentMetrics(filename)
+    token = _current_document.set(doc)
+    add_gauge('documents_in_flight', 1)
+    try:
+        yield doc
+    except BaseException:
+        doc.failed = True
+        raise
+    finally:
+        doc.finished = time.perf_counter()
+        _current_document.reset(token)
+        add_gauge('documents_in_flight', -1)
+        if not doc.failed:
+            inc('documents_scored')
+        record_stage('document', doc.finished - doc.started)
+
+def current_document():
+    return _current_document.get()
+
+# ===== PROMETHEUS TEXT FORMAT =====
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        timers = sorted(_timers.items())
+        histograms = [(key, (list(entry[0]), entry[1], entry[2])) for key, entry in sorted(_histograms.items())]
+
+    seen = set()
+    for (name, labels), value in counters:
+        metric = f'{PREFIX}{name}_total'
+        if metric not in seen:
+            lines.append(f'# TYPE {metric} counter')
+            seen.add(metric)
+        lines.append(f'{metric}{_format_labels(labels)} {value}')
+
+    for (name, labels), value in gauges:
+        metric = f'{PREFIX}{name}'
+        if metric not in seen:
+            lines.append(f'# TYPE {metric} gauge')
+            seen.add(metric)
+        lines.append(f'{metric}{_format_labels(labels)} {value}')
+
+    if timers:
+        metric = f'{PREFIX}stage_seconds'
+        lines.append(f'# TYPE {metric} summary')
+        for (stage, labels), (total, count) in timers:
+            stage_labels = (('stage', stage),) + labels
+            lines.append(f'{metric}_sum{_format_labels(stage_labels)} {total:.6f}')
+            lines.append(f'{metric}_count{_format_labels(stage_labels)} {count}')
+
+    for (name, labels), (buckets, total, count) in histograms:
+        metric = f'{PREFIX}{name}'
+        if metric not in seen:
+            lines.append(f'# TYPE {metric} histogram')
+            seen.add(metric)
+        for bound, bucket_count in zip(BATCH_SIZE_BUCKETS, buckets):
+            lines.append(f'{metric}_bucket{_format_labels(labels, [("le", bound)])} {bucket_count}')
+        lines.append(f'{metric}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+        lines.append(f'{metric}_sum{_format_labels(labels)} {total}')
+        lines.append(f'{metric}_count{_format_labels(labels)} {count}')
+
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    """Clear all process-wide metrics (benchmarks / evaluation runs)"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timers.clear()
+        _histograms.clear()
@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import pandas as pd
+
+# ===== LOCAL RESULTS STORE =====
+# One row per scored document in `documents`, features stored long-format in
+# `document_features` so new feature columns never need a schema change.
+# Indexes on company / ticker / year keep dashboard and peer queries off the PDFs.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    company TEXT,
+    ticker TEXT,
+    year INTEGER,
+    esg_cluster TEXT,
+    e_score REAL,
+    s_score REAL,
+    g_score REAL,
+    model_version TEXT,
+    taxonomy_version TEXT,
+    timings TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_company_year ON documents(company, year);
+CREATE INDEX IF NOT EXISTS idx_documents_ticker_year ON documents(ticker, year);
+CREATE INDEX IF NOT EXISTS idx_documents_year ON documents(year);
+
+CREATE TABLE IF NOT EXISTS document_features (
+    document_id INTEGER NOT NULL REFERENCES documents(id),
+    feature TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (document_id, feature)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_document_features_feature ON document_features(feature);
+"""
+
+DOCUMENT_COLUMNS = [
+    'id', 'filename', 'company', 'ticker', 'year', 'esg_cluster',
+    'e_score', 's_score', 'g_score', 'model_version', 'taxonomy_version',
+    'timings', 'created_at'
+]
+
+# Tokens of report names that look like tickers but are not (annual / ESG / sustainability report ...)
+REPORT_TOKENS = {'AR', 'ESG', 'CSR', 'SR', 'SDR', 'GRI', 'BCTN', 'BCTC', 'BCPTBV', 'BCBV', 'PTBV', 'FS', 'IR'}
+
+def parse_report_filename(filename: str):
+    """
+    Guess (ticker, year) from report names such as 'AR SAB 2023.pdf', 'ESG-Report-ACB-2022.pdf'
+    or 'BBC_2022.txt'
+
+    Returns:
+        tuple: (ticker or None, year or None)
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    year_match = re.search(r'(?<!\d)(19|20)\d{2}(?!\d)', stem)
+    year = int(year_match.group()) if year_match else None
+
+    tokens = [t for t in re.split(r'[\s_\-]+', stem) if t]
+    tickers = [t for t in tokens if re.fullmatch(r'[A-Z]{3}', t) and t not in REPORT_TOKENS]
+    ticker = tickers[0] if tickers else None
+    return ticker, year
+
+def taxonomy_version(keywords: dict) -> str:
+    """Short hash of the keyword taxonomy, changes whenever a keyword is added or moved"""
+    payload = json.dumps(keywords, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+def file_version(*paths) -> str:
+    """Short hash of model files (name, size, mtime); names that are not on disk (hub model ids) hash by name"""
+    digest = hashlib.sha1()
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f'{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}'.encode('utf-8'))
+        else:
+            digest.update(f'{path}:'.encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class ResultsStore:
+    """
+    SQLite store of scored documents
+
+    Args:
+        db_path (str): Path to the SQLite file, created on first use
+    """
+    def __init__(self, db_path='esg_results.db'):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()  # one connection shared by the service threads
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def append(self, features: dict, scores: dict = None, esg_cluster=None,
+               company=None, ticker=None, year=None,
+               model_version=None, taxonomy_version=None, timings=None) -> int:
+        """
+        Append one scored document
+
+        Args:
+            features (dict): Feature row from process_esg_files_working (non-numeric values and
+                document columns such as esg_cluster are skipped)
+            scores (dict): {'e_score', 's_score', 'g_score'} from infer_esg_scores, optional
+            esg_cluster: Cluster from assign_cluster, optional
+            company, ticker, year: Lookup keys; ticker/year default to parse_report_filename
+            model_version, taxonomy_version (str): Versions used to produce the row
+            timings (dict): Seconds spent per stage
+
+        Returns:
+            int: id of the new document row
+        """
+        filename = str(features.get('filename', ''))
+        guessed_ticker, guessed_year = parse_report_filename(filename)
+        ticker = ticker or guessed_ticker
+        year = year or guessed_year
+        scores = scores or {}
+
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                """INSERT INTO documents (filename, company, ticker, year, esg_cluster,
+                                          e_score, s_score, g_score, model_version,
+                                          taxonomy_version, timings, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    filename, company, ticker, int(year) if year else None,
+                    None if esg_cluster is None else str(esg_cluster),
+                    _to_float(scores.get('e_score')), _to_float(scores.get('s_score')),
+                    _to_float(scores.get('g_score')),
+                    model_version, taxonomy_version,
+                    json.dumps(timings or {}),
+                    time.strftime('%Y-%m-%dT%H:%M:%S'),
+                )
+            )
+            document_id = cursor.lastrowid
+            rows = []
+            for name, value in features.items():
+                if name in DOCUMENT_COLUMNS:
+                    continue
+                value = _to_float(value)
+                if value is not None:
+                    rows.append((document_id, name, value))
+            self.conn.executemany(
+                "INSERT INTO document_features (document_id, feature, value) VALUES (?, ?, ?)",
+                rows
+            )
+        return document_id
+
+    def query(self, company=None, ticker=None, year=None, with_features=True, latest=False):
+        """
+        Look up stored documents by company, ticker and/or year
+
+        Args:
+            latest (bool): Keep only the newest row per (filename, company, ticker, year)
+
+        Returns:
+            pandas DataFrame with one row per document, features as columns
+        """
+        conditions = []
+        params = []
+        for column, value in (('company', company), ('ticker', ticker), ('year', year)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        if latest:
+            id_sql = f"SELECT MAX(id) FROM documents {where} GROUP BY filename, company, ticker, year"
+        else:
+            id_sql = f"SELECT id FROM documents {where}"
+        with self.lock:
+            documents = pd.read_sql_query(
+                f"SELECT * FROM documents WHERE id IN ({id_sql}) ORDER BY id", self.conn, params=params
+            )
+            if not with_features or documents.empty:
+                return documents
+            features = pd.read_sql_query(
+                f"SELECT document_id, feature, value FROM document_features WHERE document_id IN ({id_sql})",
+                self.conn, params=params
+            )
+        wide = features.pivot(index='document_id', columns='feature', values='value')
+        return documents.merge(wide, left_on='id', right_index=True, how='left')
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,57 @@
+import os
+import csv
+import random
+
+# ===== SYNTHETIC REPORTS =====
+# Report-like documents for benchmark.py and load_test.py, built from the labeled
+# sentiment sentences mixed with numeric financial filler. Standard library only so
+# the load generator can run on a machine without the model stack.
+
+FILLER_TEMPLATES = [
+    'Doanh thu thuần năm {year} đạt {a}.{b} tỷ đồng, tăng {c},{d}% so với cùng kỳ',
+    'Lợi nhuận sau thuế quý {q} đạt {a} tỷ đồng theo báo cáo tài chính hợp nhất',
+    'Tổng tài sản tại ngày 31/12/{year} là {a}.{b}.{c} triệu đồng',
+    'Hội đồng quản trị đã thông qua kế hoạch kinh doanh năm {year} tại TP.HCM',
+    'Giá cổ phiếu đóng cửa ở mức {a}.{b} đồng/cổ phiếu vào cuối kỳ',
+    'Net revenue reached VND {a}.{b} billion in {year}, up {c}.{d}% year on year',
+]
+
+def load_benchmark_sentences(paths=('sentiment_regression.csv', 'sentiment_data.csv')):
+    """Sentences from the labeled sentiment files, de-duplicated"""
+    sentences = []
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, encoding='utf-8', newline='') as f:
+                sentences.extend(row['sentence'] for row in csv.DictReader(f) if row.get('sentence'))
+    return list(dict.fromkeys(s.strip().rstrip('.!?') for s in sentences if s.strip()))
+
+def make_filler_sentence(rng):
+    return rng.choice(FILLER_TEMPLATES).format(
+        year=rng.randint(2018, 2024), q=rng.randint(1, 4),
+        a=rng.randint(1, 999), b=rng.randint(100, 999), c=rng.randint(1, 99), d=rng.randint(0, 9)
+    )
+
+def make_synthetic_pages(sentences, n_pages, sentences_per_page=30, esg_ratio=0.3, seed=0):
+    """
+    Build the pages of a report-like document
+
+    Args:
+        sentences (list): ESG sentences to sample from
+        n_pages (int): Number of pages
+        sentences_per_page (int): Sentences on each page
+        esg_ratio (float): Share of ESG sentences, the rest is financial filler
+
+    Returns:
+        list: One string per page, ready for app.join_pages
+    """
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(n_pages):
+        page = []
+        for _ in range(sentences_per_page):
+            if rng.random() < esg_ratio:
+                page.append(rng.choice(sentences))
+            else:
+                page.append(make_filler_sentence(rng))
+        pages.append('. '.join(page) + '.')
+    return pages
@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext, ExitStack
+
+# ===== PER-DOCUMENT TRACING =====
+# Opt-in: spans are only recorded inside a `trace_document(...)` block that has a
+# trace directory (argument or ESG_TRACE_DIR). Outside of it `span()` is a no-op.
+# Output is Chrome trace JSON, open it in https://ui.perfetto.dev or chrome://tracing.
+
+_current_tracer = contextvars.ContextVar('esg_current_tracer', default=None)
+_NO_SPAN = nullcontext()
+# torch.profiler is process-global, torch-profiled documents take turns
+_torch_profile_lock = threading.Lock()
+
+class Tracer:
+    """Collects complete ('X') events for one document"""
+    def __init__(self, name, record_torch_functions=False):
+        self.name = name
+        self.path = None
+        self.torch_path = None
+        self.record_torch_functions = record_torch_functions
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = threading.Lock()
+
+    def add(self, name, cat, start, end, args):
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': round((start - self.origin) * 1e6, 3),
+            'dur': round((end - start) * 1e6, 3),
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def to_chrome_trace(self):
+        thread_names = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': f'worker-{i}'}}
+            for i, tid in enumerate(sorted({e['tid'] for e in self.events}))
+        ]
+        process_name = {'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'args': {'name': self.name}}
+        return {
+            'traceEvents': [process_name] + thread_names + self.events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'document': self.name},
+        }
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
+        self.path = path
+
+@contextmanager
+def _record_span(tracer, name, cat, args):
+    start = time.perf_counter()
+    try:
+        if tracer.record_torch_functions:
+            import torch
+            with torch.profiler.record_function(name):
+                yield
+        else:
+            yield
+    finally:
+        tracer.add(name, cat, start, time.perf_counter(), args)
+
+def span(name, cat='stage', **args):
+    """Nested span, e.g. `with tracing.span('page', cat='pdf', page=3):`; free when tracing is off"""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        return _NO_SPAN
+    return _record_span(tracer, name, cat, args)
+
+def current_tracer():
+    return _current_tracer.get()
+
+def _safe_name(name):
+    return re.sub(r'[^\w.-]+', '_', os.path.basename(name)).strip('_') or 'document'
+
+@contextmanager
+def trace_document(name, trace_dir=None, torch_profile=False):
+    """
+    Trace everything inside the block and write <trace_dir>/<name>_<time>_<pid>_<id>.trace.json
+
+    Args:
+        name (str): Document name, can be changed later through tracer.name
+        trace_dir (str): Output directory; falls back to ESG_TRACE_DIR, no tracing if neither is set
+        torch_profile (bool): Also run torch.profiler and write <...>.torch.json next to the trace;
+            torch-profiled blocks run one at a time, a second one waits for the first
+
+    Yields:
+        Tracer or None when tracing is off
+    """
+    trace_dir = trace_dir or os.environ.get('ESG_TRACE_DIR')
+    if not trace_dir:
+        yield None
+        return
+
+    with _torch_profile_lock if torch_profile else nullcontext():
+        tracer = Tracer(name, record_torch_functions=torch_profile)
+        token = _current_tracer.set(tracer)
+        with ExitStack() as stack:
+            profiler = None
+            if torch_profile:
+                import torch
+                profiler = stack.enter_context(torch.profiler.profile(
+                    activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True
+                ))
+            try:
+                with span('document', cat='document'):
+                    yield tracer
+            finally:
+                _current_tracer.reset(token)
+                stack.close()
+
+                os.makedirs(trace_dir, exist_ok=True)
+                # pid + random suffix: the same document can be traced twice in one second
+                stamp = f"{time.strftime('%Y%m%d-%H%M%S')}_{tracer.pid}_{uuid.uuid4().hex[:8]}"
+                base = os.path.join(trace_dir, f"{_safe_name(tracer.name)}_{stamp}")
+                tracer.save(f'{base}.trace.json')
+                if profiler is not None:
+                    tracer.torch_path = f'{base}.torch.json'
+                    profiler.export_chrome_trace(tracer.torch_path)
+                print(f"🧭 Trace saved to {tracer.path}")